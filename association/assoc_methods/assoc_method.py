@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Callable, Optional, Sequence, Tuple
+
+import numpy as np
 
 from dto.plane import Plane
 
@@ -8,3 +10,38 @@ class AssocMethod(ABC):
     @abstractmethod
     def get_result(self, prev: Plane, cur: Plane) -> Optional[float]:
         pass
+
+    def get_result_matrix(
+        self, prev_planes: Sequence[Plane], cur_planes: Sequence[Plane]
+    ) -> np.ndarray:
+        """
+        Calculates metric for all pairs of planes.
+        Methods override it with vectorized implementation,
+        by default get_result is called for each pair
+        :param prev_planes: Planes from previous frame
+        :param cur_planes: Planes from current frame
+        :return: Matrix of shape (len(prev_planes), len(cur_planes))
+            with NaN for pairs without result
+        """
+        results = np.full((len(prev_planes), len(cur_planes)), np.nan)
+        for i, prev in enumerate(prev_planes):
+            for j, cur in enumerate(cur_planes):
+                metric_result = self.get_result(prev, cur)
+                if metric_result is not None:
+                    results[i, j] = metric_result
+        return results
+
+    def get_result_bounds(
+        self, prev_planes: Sequence[Plane], cur_planes: Sequence[Plane]
+    ) -> Optional[Tuple[np.ndarray, Callable[[int, int], float]]]:
+        """
+        Lower bounds of metric for all pairs of planes and function that
+        evaluates exact metric of one pair, so greedy matching evaluates only
+        pairs it reaches. By default methods evaluate all pairs at once
+        :param prev_planes: Planes from previous frame
+        :param cur_planes: Planes from current frame
+        :return: Matrix of shape (len(prev_planes), len(cur_planes)) with NaN
+            for pairs without result and function of previous and current
+            plane indices, or None if bounds aren't supported
+        """
+        return None
@@ -1,18 +1,75 @@
 import math
+from contextlib import contextmanager
 from numbers import Number
-from typing import Optional
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 
 from association.assoc_methods.assoc_method import AssocMethod
-from association.utils import get_angle_cos, get_distance, get_jaccard_index
+from association.utils import (
+    MINHASH_ERROR,
+    get_angle_cos,
+    get_angle_cos_matrix,
+    get_distance,
+    get_distance_matrix,
+    get_jaccard_index,
+    get_jaccard_index_matrix,
+    get_pair_jaccard_function,
+    get_size_ratio_matrix,
+)
 from dto.plane import Plane
 
 
+# All evaluated pairs and pairs pruned by each level of the prefilter
+PRUNE_LEVELS = ["pairs", "angle", "distance", "iou_bound"]
+
+
 class JaccardThresholded(AssocMethod):
-    def __init__(self, limit_distance: float = 0.1, limit_angle: Number = np.pi / 18):
+    def __init__(
+        self,
+        limit_distance: float = 0.1,
+        limit_angle: Number = np.pi / 18,
+        jaccard_backend: str = "contingency",
+        minhash_error: float = MINHASH_ERROR,
+    ):
         self.limit_distance = limit_distance
         self.limit_angle = limit_angle
+        self.limit_cos = np.cos(limit_angle)
+        self.jaccard_backend = jaccard_backend
+        self.minhash_error = minhash_error
+        self.prune_counts = dict.fromkeys(PRUNE_LEVELS, 0)
+        self.count_pruned = False
+
+    @contextmanager
+    def counting_pruned(self) -> Iterator[dict]:
+        """
+        Counts pruned pairs of association within the context. Scoring has no
+        side effects otherwise, so repeated runs of the same pairs aren't counted
+        :return: Context with counts of pruned pairs by level
+        """
+        self.count_pruned = True
+        try:
+            yield self.prune_counts
+        finally:
+            self.count_pruned = False
+
+    def get_prune_levels(self) -> List[str]:
+        """
+        Levels of the prefilter used with the Jaccard backend, only backends
+        that evaluate single pairs are bounded by IoU
+        """
+        if self.jaccard_backend != "bitmask":
+            return PRUNE_LEVELS[:-1]
+        return PRUNE_LEVELS
+
+    def get_prune_report(self) -> dict:
+        """
+        :return: Jaccard backend and counts of levels used with it
+        """
+        return {
+            "backend": self.jaccard_backend,
+            **{level: self.prune_counts[level] for level in self.get_prune_levels()},
+        }
 
     def get_result(self, prev: Plane, cur: Plane) -> Optional[float]:
         """
@@ -25,7 +82,79 @@ class JaccardThresholded(AssocMethod):
         """
         angle_cos = get_angle_cos(cur, prev)
         distance = get_distance(cur, prev)
-        if (
-            math.fabs(angle_cos) > np.cos(self.limit_angle)
-        ) and distance < self.limit_distance:
+        if (math.fabs(angle_cos) > self.limit_cos) and distance < self.limit_distance:
             return 1 - get_jaccard_index(cur, prev)
+
+    def get_candidate_mask(
+        self, prev_planes: Sequence[Plane], cur_planes: Sequence[Plane]
+    ) -> np.ndarray:
+        """
+        Prefilter that gates all pairs of planes on angle and distance at once,
+        pairs pruned by each threshold are counted within counting_pruned
+        :param prev_planes: Planes from previous frame
+        :param cur_planes: Planes from current frame
+        :return: Matrix of pairs that pass both thresholds
+        """
+        angle_cos = get_angle_cos_matrix(prev_planes, cur_planes)
+        distance = get_distance_matrix(prev_planes, cur_planes)
+        is_parallel = np.abs(angle_cos) > self.limit_cos
+        is_close = distance < self.limit_distance
+
+        if self.count_pruned:
+            self.prune_counts["pairs"] += is_parallel.size
+            self.prune_counts["angle"] += int(np.count_nonzero(~is_parallel))
+            self.prune_counts["distance"] += int(
+                np.count_nonzero(is_parallel & ~is_close)
+            )
+        return is_parallel & is_close
+
+    def get_result_matrix(
+        self, prev_planes: Sequence[Plane], cur_planes: Sequence[Plane]
+    ) -> np.ndarray:
+        """
+        Vectorized angle-distance-Jaccard method.
+        Jaccard indices are evaluated only for pairs that pass both thresholds.
+        :param prev_planes: Planes from previous frame
+        :param cur_planes: Planes from current frame
+        :return: Matrix of (1 - Jaccard index) with NaN for filtered pairs
+        """
+        mask = self.get_candidate_mask(prev_planes, cur_planes)
+        return 1 - get_jaccard_index_matrix(
+            prev_planes, cur_planes, mask, self.jaccard_backend, self.minhash_error
+        )
+
+    def get_result_bounds(
+        self, prev_planes: Sequence[Plane], cur_planes: Sequence[Plane]
+    ) -> Optional[Tuple[np.ndarray, Callable[[int, int], float]]]:
+        """
+        Bounds results of pairs that pass both thresholds with the size ratio:
+        Jaccard index can't exceed min(|A|, |B|) / max(|A|, |B|).
+        Exact Jaccard index is evaluated only for pairs that greedy matching
+        reaches, other pairs are counted as pruned by the IoU bound.
+        Contingency and MinHash backends evaluate all pairs at once,
+        so they have no bounds
+        :param prev_planes: Planes from previous frame
+        :param cur_planes: Planes from current frame
+        :return: Matrix of result bounds with NaN for filtered pairs
+            and function that evaluates result of one pair
+        """
+        if self.jaccard_backend != "bitmask":
+            return None
+        mask = self.get_candidate_mask(prev_planes, cur_planes)
+        bounds = np.where(
+            mask, 1 - get_size_ratio_matrix(prev_planes, cur_planes), np.nan
+        )
+        count_pruned = self.count_pruned
+        if count_pruned:
+            self.prune_counts["iou_bound"] += int(np.count_nonzero(mask))
+        get_pair_jaccard = get_pair_jaccard_function(self.jaccard_backend)
+
+        def evaluate(prev_index: int, cur_index: int) -> float:
+            if count_pruned:
+                self.prune_counts["iou_bound"] -= 1
+            return 1 - get_pair_jaccard(prev_planes[prev_index], cur_planes[cur_index])
+
+        return bounds, evaluate
+
+    def reset_prune_counts(self):
+        self.prune_counts = dict.fromkeys(PRUNE_LEVELS, 0)
@@ -1,12 +1,32 @@
+from typing import Sequence
+
+import numpy as np
+
 from association.assoc_methods.assoc_method import AssocMethod
-from association.utils import get_angle_cos, get_distance, get_jaccard_index
+from association.utils import (
+    MINHASH_ERROR,
+    get_angle_cos,
+    get_angle_cos_matrix,
+    get_distance,
+    get_distance_matrix,
+    get_jaccard_index,
+    get_jaccard_index_matrix,
+)
 from dto.plane import Plane
 
 
 class JaccardWeighed(AssocMethod):
-    def __init__(self, angle_weight: int = 5, jaccard_weight: int = 2):
+    def __init__(
+        self,
+        angle_weight: int = 5,
+        jaccard_weight: int = 2,
+        jaccard_backend: str = "contingency",
+        minhash_error: float = MINHASH_ERROR,
+    ):
         self.angle_weight = angle_weight
         self.jaccard_weight = jaccard_weight
+        self.jaccard_backend = jaccard_backend
+        self.minhash_error = minhash_error
 
     def get_result(self, prev: Plane, cur: Plane) -> float:
         """
@@ -29,3 +49,26 @@ class JaccardWeighed(AssocMethod):
             + (1 - jaccard) * self.jaccard_weight
         )
         return result
+
+    def get_result_matrix(
+        self, prev_planes: Sequence[Plane], cur_planes: Sequence[Plane]
+    ) -> np.ndarray:
+        """
+        Vectorized angle-distance-Jaccard weighed method.
+        :param prev_planes: Planes from previous frame
+        :param cur_planes: Planes from current frame
+        :return: Matrix of metric results for all pairs of planes
+        """
+        angle_cos = get_angle_cos_matrix(prev_planes, cur_planes)
+        distance = get_distance_matrix(prev_planes, cur_planes)
+        jaccard = get_jaccard_index_matrix(
+            prev_planes,
+            cur_planes,
+            backend=self.jaccard_backend,
+            minhash_error=self.minhash_error,
+        )
+        return (
+            (1 - angle_cos) * self.angle_weight
+            + distance
+            + (1 - jaccard) * self.jaccard_weight
+        )
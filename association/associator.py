@@ -1,11 +1,15 @@
-from typing import List
+from typing import Sequence, Tuple
+
+import numpy as np
 
 from association.assoc_methods.assoc_method import AssocMethod
+from association.matching import match_greedy, match_greedy_lazy, match_optimal
 from dto.plane import Plane
+from tracing import TRACER
 
 
 class Associator:
-    def __init__(self, cur_planes: List[Plane], prev_planes: List[Plane]):
+    def __init__(self, cur_planes: Sequence[Plane], prev_planes: Sequence[Plane]):
         """
         Associates planes from current frame with planes from previous frame
         :param cur_planes: All planes from current frame to associate
@@ -14,31 +18,54 @@ class Associator:
         self.cur_planes = cur_planes
         self.prev_planes = prev_planes
 
-    def associate(self, method: AssocMethod):
+    def match(
+        self, method: AssocMethod, optimal: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Matches planes by minimizing metric result without repeats
+        :param method: Method for calculating metric between planes
+        :param optimal: Use globally optimal assignment instead of greedy matching
+        :return: Indices of matched current planes and indices of their previous planes
+        """
+        with TRACER.span(
+            "match", cur_planes=len(self.cur_planes), prev_planes=len(self.prev_planes)
+        ):
+            if not optimal:
+                with TRACER.span("score_bounds"):
+                    bounds = method.get_result_bounds(self.prev_planes, self.cur_planes)
+                if bounds is not None:
+                    lower_bounds, evaluate = bounds
+                    with TRACER.span("match_lazy"):
+                        return match_greedy_lazy(
+                            lower_bounds.T,
+                            lambda cur_index, prev_index: evaluate(
+                                prev_index, cur_index
+                            ),
+                        )
+
+            # Transposed to keep the pairs order of the per-pair loop:
+            # current planes outside
+            with TRACER.span("score"):
+                results = method.get_result_matrix(self.prev_planes, self.cur_planes).T
+            with TRACER.span("assign", optimal=optimal):
+                if optimal:
+                    return match_optimal(results)
+                return match_greedy(results)
+
+    def associate(self, method: AssocMethod, optimal: bool = False):
         """
         Matches planes by minimizing metric result without repeats
         :param method: Method for calculating metric between planes
+        :param optimal: Use globally optimal assignment instead of greedy matching
         :return: Associated planes
         """
-        results = {}
-        for cur in self.cur_planes:
-            for prev in self.prev_planes:
-                cur_pair = (cur, prev)
-                metric_result = method.get_result(prev, cur)
-                if metric_result is not None:
-                    results[cur_pair] = metric_result
-
-        sorted_res = sorted(results.items(), key=lambda item: item[1])
-
-        prev_used = set()
-        associated = dict.fromkeys(self.cur_planes)
-        for pair, result in sorted_res:
-            cur, prev = pair
-
-            if associated[cur] is not None or prev in prev_used:
-                continue
-
-            associated[cur] = prev
-            prev_used.add(prev)
+        with TRACER.span(
+            "associate",
+            cur_planes=len(self.cur_planes),
+            prev_planes=len(self.prev_planes),
+        ):
+            associated = dict.fromkeys(self.cur_planes)
+            for cur_index, prev_index in zip(*self.match(method, optimal)):
+                associated[self.cur_planes[cur_index]] = self.prev_planes[prev_index]
 
         return associated
@@ -0,0 +1,121 @@
+import heapq
+import math
+from typing import Callable, Tuple
+
+import numpy as np
+
+
+def match_greedy(costs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Greedily matches rows with columns in order of increasing cost without repeats.
+    Equal costs are resolved in row-major order.
+    Each round takes all pairs that are the best ones both in their row and column,
+    these are exactly the pairs that sequential walk over sorted costs takes.
+    Then matched rows and columns are removed from the matrix.
+    :param costs: Matrix of costs, NaN for pairs that can't be matched
+    :return: Indices of matched rows and columns sorted by rows
+    """
+    costs = np.where(np.isnan(costs), np.inf, costs)
+    row_ids = np.arange(costs.shape[0])
+    col_ids = np.arange(costs.shape[1])
+
+    matched_rows = []
+    matched_cols = []
+    while costs.size != 0:
+        # argmin takes the first of equal costs, which is the row-major order
+        positions = np.arange(costs.shape[0])
+        best_cols = costs.argmin(axis=1)
+        best_rows = costs.argmin(axis=0)
+        rows = np.flatnonzero(
+            (best_rows[best_cols] == positions)
+            & np.isfinite(costs[positions, best_cols])
+        )
+        if len(rows) == 0:
+            break
+        cols = best_cols[rows]
+        matched_rows.append(row_ids[rows])
+        matched_cols.append(col_ids[cols])
+
+        rows_left = np.ones(len(row_ids), dtype=bool)
+        rows_left[rows] = False
+        cols_left = np.ones(len(col_ids), dtype=bool)
+        cols_left[cols] = False
+        costs = costs[rows_left][:, cols_left]
+        row_ids = row_ids[rows_left]
+        col_ids = col_ids[cols_left]
+
+    return __sorted_by_rows(matched_rows, matched_cols)
+
+
+def match_greedy_lazy(
+    bounds: np.ndarray, evaluate: Callable[[int, int], float]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Greedy matching that evaluates exact costs only for pairs it reaches.
+    Pairs are walked in order of increasing cost like in match_greedy,
+    a pair that is reached with its lower bound is evaluated and walked again
+    with the exact cost. Pairs behind matched rows and columns are never evaluated,
+    the result is the same as match_greedy of exact costs
+    :param bounds: Lower bounds of costs, NaN for pairs that can't be matched
+    :param evaluate: Function that returns exact cost of row and column pair
+    :return: Indices of matched rows and columns sorted by rows
+    """
+    rows, cols = np.nonzero(~np.isnan(bounds))
+    # Equal costs are walked in row-major order, exact costs after equal bounds
+    heap = [
+        (cost, row, col, False)
+        for cost, row, col in zip(
+            bounds[rows, cols].tolist(), rows.tolist(), cols.tolist()
+        )
+    ]
+    heapq.heapify(heap)
+
+    matched_rows = []
+    matched_cols = []
+    is_row_matched = np.zeros(bounds.shape[0], dtype=bool)
+    is_col_matched = np.zeros(bounds.shape[1], dtype=bool)
+    while len(heap) != 0:
+        cost, row, col, is_exact = heapq.heappop(heap)
+        if is_row_matched[row] or is_col_matched[col]:
+            continue
+        if not is_exact:
+            cost = evaluate(row, col)
+            if not math.isnan(cost):
+                heapq.heappush(heap, (cost, row, col, True))
+            continue
+        is_row_matched[row] = is_col_matched[col] = True
+        matched_rows.append(row)
+        matched_cols.append(col)
+
+    return __sorted_by_rows(
+        [np.asarray(matched_rows, dtype=np.int64)],
+        [np.asarray(matched_cols, dtype=np.int64)],
+    )
+
+
+def match_optimal(costs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matches rows with columns with the minimal total cost (Hungarian algorithm).
+    Pairs that can't be matched get cost higher than any complete valid matching,
+    so the number of valid pairs is maximized first.
+    :param costs: Matrix of costs, NaN for pairs that can't be matched
+    :return: Indices of matched rows and columns sorted by rows
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    valid = ~np.isnan(costs)
+    if not valid.any():
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    valid_costs = costs[valid]
+    spread = valid_costs.max() - valid_costs.min() + 1
+    forbidden_cost = valid_costs.max() + spread * min(costs.shape)
+    rows, cols = linear_sum_assignment(np.where(valid, costs, forbidden_cost))
+    is_valid = valid[rows, cols]
+    return __sorted_by_rows([rows[is_valid]], [cols[is_valid]])
+
+
+def __sorted_by_rows(rows_parts, cols_parts) -> Tuple[np.ndarray, np.ndarray]:
+    rows = np.concatenate(rows_parts or [np.empty(0, dtype=np.int64)])
+    cols = np.concatenate(cols_parts or [np.empty(0, dtype=np.int64)])
+    order = np.argsort(rows)
+    return rows[order], cols[order]
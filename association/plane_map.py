@@ -0,0 +1,173 @@
+import itertools
+import math
+from collections import defaultdict
+from numbers import Number
+from typing import Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from association.assoc_methods.assoc_method import AssocMethod
+from association.matching import match_greedy, match_optimal
+from dto.bitmask import Bitmask
+from dto.plane import Plane
+
+Cell = Tuple[int, int, int, int]
+
+
+class PlaneMap:
+    # Offsets of the cell and its neighbours in all 4 dimensions
+    __NEIGHBOURS = np.asarray(list(itertools.product([-1, 0, 1], repeat=4)))
+
+    def __init__(self, limit_distance: float = 0.1, limit_angle: Number = np.pi / 18):
+        """
+        Map of landmark planes with persistent IDs.
+        Landmarks are indexed in a bucketed grid over (normal, d) with cells
+        of the threshold sizes, so only neighbouring cells of a plane and of its
+        flipped normal can hold planes that pass both thresholds.
+        Thresholds have the same meaning as in JaccardThresholded
+        :param limit_distance: Limit of difference between distances from the origin
+        :param limit_angle: Limit of angle between normals
+        """
+        self.limit_distance = limit_distance
+        self.limit_angle = limit_angle
+        self.limit_cos = np.cos(limit_angle)
+        # Normals within the angle differ by at most the chord in each component
+        self.normal_cell_size = 2 * math.sin(limit_angle / 2)
+        self.landmarks: Dict[int, Plane] = {}
+        self.planes_count = 0
+        self.__cells: Dict[Cell, Set[int]] = defaultdict(set)
+        self.__landmark_cells: Dict[int, Cell] = {}
+
+    def __len__(self) -> int:
+        return len(self.landmarks)
+
+    def add(self, plane: Plane) -> int:
+        """
+        Adds new landmark
+        :return: ID of the landmark
+        """
+        landmark_id = self.planes_count
+        self.planes_count += 1
+        self.update(landmark_id, plane)
+        return landmark_id
+
+    def update(self, landmark_id: int, plane: Plane):
+        """
+        Replaces landmark with its latest observation. The observation is copied,
+        planes of a frame are views of its arrays that would keep the whole frame.
+        Only point indices, bitmask, equation and label are kept,
+        association doesn't use points and colors of landmarks
+        """
+        if landmark_id in self.landmarks:
+            self.remove(landmark_id)
+        cell = tuple(self.__get_cell(plane.equation).tolist())
+        self.landmarks[landmark_id] = self.__copy_plane(plane)
+        self.__landmark_cells[landmark_id] = cell
+        self.__cells[cell].add(landmark_id)
+
+    def remove(self, landmark_id: int):
+        cell = self.__landmark_cells.pop(landmark_id)
+        self.__cells[cell].discard(landmark_id)
+        if len(self.__cells[cell]) == 0:
+            del self.__cells[cell]
+        del self.landmarks[landmark_id]
+
+    def get_candidates(self, plane: Plane) -> List[int]:
+        """
+        Finds landmarks with an angle and distance below the thresholds
+        :return: IDs of landmarks in increasing order
+        """
+        equation = np.asarray(plane.equation, dtype=float)
+        flipped = np.append(-equation[:3], equation[3])
+        cells = np.concatenate(
+            [
+                self.__get_cell(equation) + self.__NEIGHBOURS,
+                self.__get_cell(flipped) + self.__NEIGHBOURS,
+            ]
+        )
+        cells = map(tuple, cells.tolist())
+        landmark_ids = set().union(
+            *[self.__cells[cell] for cell in cells if cell in self.__cells]
+        )
+        if len(landmark_ids) == 0:
+            return []
+
+        landmark_ids = sorted(landmark_ids)
+        equations = np.asarray(
+            [self.landmarks[landmark_id].equation for landmark_id in landmark_ids]
+        )
+        normal = equation[:3]
+        angle_cos = (equations[:, :3] @ normal) / (
+            np.linalg.norm(equations[:, :3], axis=1) * np.linalg.norm(normal)
+        )
+        distance = np.abs(equations[:, 3] - equation[3])
+        is_close = (np.abs(angle_cos) > self.limit_cos) & (
+            distance < self.limit_distance
+        )
+        return [
+            landmark_id for landmark_id, close in zip(landmark_ids, is_close) if close
+        ]
+
+    def associate(
+        self, planes: Sequence[Plane], method: AssocMethod, optimal: bool = False
+    ) -> np.ndarray:
+        """
+        Associates planes of a frame with landmarks and updates the map:
+        matched landmarks take new observations, other planes become new landmarks.
+        Method is evaluated only for pairs with landmarks that pass the thresholds,
+        each pair on its own: landmarks come from different frames, so their point
+        indices overlap and can't be labeled at once
+        :param planes: All planes of the frame
+        :param method: Method for calculating metric between planes
+        :param optimal: Use globally optimal assignment instead of greedy matching
+        :return: Landmark ID of each plane
+        """
+        candidates = [self.get_candidates(plane) for plane in planes]
+        candidate_ids = sorted(set(itertools.chain.from_iterable(candidates)))
+        positions = {
+            landmark_id: position for position, landmark_id in enumerate(candidate_ids)
+        }
+
+        ids = np.full(len(planes), -1)
+        if len(candidate_ids) != 0:
+            results = np.full((len(planes), len(candidate_ids)), np.nan)
+            for plane_index, plane_candidates in enumerate(candidates):
+                for landmark_id in plane_candidates:
+                    metric_result = method.get_result(
+                        self.landmarks[landmark_id], planes[plane_index]
+                    )
+                    if metric_result is not None:
+                        results[plane_index, positions[landmark_id]] = metric_result
+
+            match = match_optimal if optimal else match_greedy
+            plane_indices, candidate_indices = match(results)
+            ids[plane_indices] = np.asarray(candidate_ids)[candidate_indices]
+
+        for plane_index, plane in enumerate(planes):
+            if ids[plane_index] == -1:
+                ids[plane_index] = self.add(plane)
+            else:
+                self.update(int(ids[plane_index]), plane)
+        return ids
+
+    @staticmethod
+    def __copy_plane(plane: Plane) -> Plane:
+        bitmask = plane.bitmask
+        if bitmask is not None:
+            bitmask = Bitmask(bitmask.words.copy(), bitmask.start, bitmask.count)
+        return Plane(
+            np.empty((0, 3), dtype=np.asarray(plane.points).dtype),
+            np.array(plane.pcd_indices),
+            np.array(plane.equation),
+            None,
+            bitmask,
+            plane.label,
+        )
+
+    def __get_cell(self, equation: np.ndarray) -> np.ndarray:
+        equation = np.asarray(equation, dtype=float)
+        normal = equation[:3] / np.linalg.norm(equation[:3])
+        return np.append(
+            np.floor(normal / self.normal_cell_size),
+            math.floor(equation[3] / self.limit_distance),
+        ).astype(int)
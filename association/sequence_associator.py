@@ -0,0 +1,55 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+from association.assoc_methods.assoc_method import AssocMethod
+from association.associator import Associator
+from dto.plane import Plane
+from dto.plane_set import PlaneSet
+
+
+class SequenceAssociator:
+    def __init__(self, method: AssocMethod, optimal: bool = False):
+        """
+        Associates planes of a frame stream, each frame with the previous one,
+        and assigns global plane IDs that persist over the sequence.
+        Only the previous frame is kept, so memory doesn't grow with the sequence
+        :param method: Method for calculating metric between planes
+        :param optimal: Use globally optimal assignment instead of greedy matching
+        """
+        self.method = method
+        self.optimal = optimal
+        self.prev_planes: Optional[PlaneSet] = None
+        self.prev_ids: Optional[np.ndarray] = None
+        self.planes_count = 0
+
+    def push(self, planes: Sequence[Plane]) -> np.ndarray:
+        """
+        Associates planes of the next frame with planes of the previous one.
+        Data derived from the frame, like its point labels, is computed once
+        and reused when the frame becomes the previous one
+        :param planes: All planes of the next frame
+        :return: Global ID of each plane, planes without association get new IDs
+        """
+        if not isinstance(planes, PlaneSet):
+            planes = PlaneSet.from_planes(list(planes))
+
+        ids = np.full(len(planes), -1)
+        if self.prev_planes is not None:
+            associator = Associator(planes, self.prev_planes)
+            cur_indices, prev_indices = associator.match(self.method, self.optimal)
+            ids[cur_indices] = self.prev_ids[prev_indices]
+        is_new = ids == -1
+        ids[is_new] = self.planes_count + np.arange(np.count_nonzero(is_new))
+        self.planes_count += np.count_nonzero(is_new)
+
+        self.prev_planes = planes
+        self.prev_ids = ids
+        return ids
+
+    def reset(self):
+        """
+        Starts a new sequence, global IDs keep growing
+        """
+        self.prev_planes = None
+        self.prev_ids = None
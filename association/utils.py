@@ -1,7 +1,15 @@
 import math
+from typing import Callable, Optional, Sequence
+
 import numpy as np
 
+from dto.minhash import build_sketches, estimate_jaccard_matrix, get_sketch_size
 from dto.plane import Plane
+from dto.plane_set import PlaneSet
+
+JACCARD_BACKENDS = ["contingency", "bitmask", "minhash"]
+# Default bound of standard deviation of approximate Jaccard indices
+MINHASH_ERROR = 0.02
 
 
 def get_jaccard_index(plane1: Plane, plane2: Plane) -> float:
@@ -11,6 +19,18 @@ def get_jaccard_index(plane1: Plane, plane2: Plane) -> float:
     return jaccard
 
 
+def get_jaccard_index_bitmask(plane1: Plane, plane2: Plane) -> float:
+    """
+    Calculates Jaccard index with popcount over packed membership bitmasks,
+    so the cost doesn't depend on plane sizes
+    """
+    if plane1.bitmask is None or plane2.bitmask is None:
+        raise ValueError("Planes must be extracted with bitmasks")
+    intersection = plane1.bitmask.intersection_count(plane2.bitmask)
+    union = plane1.bitmask.count + plane2.bitmask.count - intersection
+    return intersection / union
+
+
 def get_angle_cos(plane1: Plane, plane2: Plane) -> float:
     normal1 = plane1.equation[:3]
     normal2 = plane2.equation[:3]
@@ -24,3 +44,188 @@ def get_distance(plane1: Plane, plane2: Plane) -> float:
     d1 = plane1.equation[-1]
     d2 = plane2.equation[-1]
     return math.fabs(d1 - d2)
+
+
+def get_equations(planes: Sequence[Plane]) -> np.ndarray:
+    """
+    Stacks plane equations into one array
+    :param planes: Planes of one frame
+    :return: Array of shape (len(planes), 4)
+    """
+    if isinstance(planes, PlaneSet):
+        return planes.equations
+    equations = np.asarray([plane.equation for plane in planes]).reshape((-1, 4))
+    # Type of equations is kept, so float32 planes are compared in float32
+    if not np.issubdtype(equations.dtype, np.floating):
+        equations = equations.astype(float)
+    return equations
+
+
+def get_sizes(planes: Sequence[Plane]) -> np.ndarray:
+    if isinstance(planes, PlaneSet):
+        return planes.sizes
+    return np.asarray([len(plane.pcd_indices) for plane in planes], dtype=int)
+
+
+def get_labels(planes: Sequence[Plane]) -> Optional[np.ndarray]:
+    """
+    Builds per-point plane labels of one frame, PlaneSet builds them once
+    :param planes: Planes of one frame
+    :return: Array with plane index for each point up to the largest point index,
+        len(planes) for unlabeled points, None if planes share points
+    """
+    if isinstance(planes, PlaneSet):
+        return planes.point_labels
+    max_index = max((int(plane.pcd_indices.max()) for plane in planes), default=-1)
+    labels = np.full(max_index + 1, len(planes))
+    for label, plane in enumerate(planes):
+        labels[plane.pcd_indices] = label
+    sizes = np.bincount(labels, minlength=len(planes) + 1)[:-1]
+    if (sizes != get_sizes(planes)).any():
+        return None
+    return labels
+
+
+def get_intersection_matrix(
+    planes1: Sequence[Plane], planes2: Sequence[Plane]
+) -> Optional[np.ndarray]:
+    """
+    Counts common points for all pairs of planes with a single bincount
+    over combined labels of both frames
+    :return: Matrix of shape (len(planes1), len(planes2)) or None
+        if planes of one frame share points, so labels are ambiguous
+    """
+    labels1 = get_labels(planes1)
+    labels2 = get_labels(planes2)
+    if labels1 is None or labels2 is None:
+        return None
+    # Points beyond the shorter labels are unlabeled in one of the frames
+    points_count = min(len(labels1), len(labels2))
+
+    labels_count1 = len(planes1) + 1
+    labels_count2 = len(planes2) + 1
+    # Labels are kept in compact types, so pairs are combined in intp
+    pairs = labels1[:points_count].astype(np.intp) * labels_count2
+    pairs += labels2[:points_count]
+    contingency = np.bincount(
+        pairs,
+        minlength=labels_count1 * labels_count2,
+    ).reshape((labels_count1, labels_count2))
+    return contingency[:-1, :-1]
+
+
+def get_sketches(planes: Sequence[Plane], sketch_size: int) -> np.ndarray:
+    """
+    Builds bottom-k sketches of planes of one frame, PlaneSet builds them once
+    :return: Sketches of shape (len(planes), sketch_size)
+    """
+    if isinstance(planes, PlaneSet):
+        return planes.get_sketches(sketch_size)
+    sizes = get_sizes(planes)
+    indices = np.concatenate(
+        [plane.pcd_indices for plane in planes] or [np.empty(0, dtype=int)]
+    )
+    return build_sketches(indices, np.concatenate([[0], np.cumsum(sizes)]), sketch_size)
+
+
+def get_pair_jaccard_function(backend: str) -> Callable[[Plane, Plane], float]:
+    """
+    Function that evaluates Jaccard index of one pair of planes with the backend
+    :param backend: Backend from list: ['contingency', 'bitmask']
+    """
+    if backend not in ["contingency", "bitmask"]:
+        raise ValueError(f"Backend {backend} doesn't evaluate single pairs")
+    if backend == "bitmask":
+        return get_jaccard_index_bitmask
+    return get_jaccard_index
+
+
+def get_size_ratio_matrix(
+    planes1: Sequence[Plane], planes2: Sequence[Plane]
+) -> np.ndarray:
+    """
+    Calculates min(|A|, |B|) / max(|A|, |B|) for all pairs of planes,
+    it is an upper bound of their Jaccard index
+    :return: Matrix of shape (len(planes1), len(planes2))
+    """
+    sizes1 = get_sizes(planes1)[:, np.newaxis]
+    sizes2 = get_sizes(planes2)[np.newaxis, :]
+    return np.minimum(sizes1, sizes2) / np.maximum(sizes1, sizes2)
+
+
+def get_jaccard_index_matrix(
+    planes1: Sequence[Plane],
+    planes2: Sequence[Plane],
+    mask: Optional[np.ndarray] = None,
+    backend: str = "contingency",
+    minhash_error: float = MINHASH_ERROR,
+) -> np.ndarray:
+    """
+    Calculates Jaccard indices for all pairs of planes.
+    With "contingency" backend intersections come from the contingency matrix
+    of frame labels and unions from plane sizes, so the cost is O(N + P * Q).
+    It falls back to per-pair evaluation if planes of one frame share points.
+    With "bitmask" backend each pair is evaluated with get_jaccard_index_bitmask.
+    With "minhash" backend indices are estimated from bottom-k sketches of planes,
+    so the cost depends on the sketch size instead of plane sizes.
+    :param planes1: Planes of the first frame
+    :param planes2: Planes of the second frame
+    :param mask: Boolean matrix of pairs to evaluate, all pairs by default
+    :param backend: Backend from list: ['contingency', 'bitmask', 'minhash']
+    :param minhash_error: Bound of standard deviation of "minhash" estimates
+    :return: Matrix of shape (len(planes1), len(planes2)), NaN for skipped pairs
+    """
+    if backend not in JACCARD_BACKENDS:
+        raise ValueError(f"Unknown Jaccard backend: {backend}")
+    shape = (len(planes1), len(planes2))
+    if mask is None:
+        mask = np.ones(shape, dtype=bool)
+
+    if backend == "minhash":
+        sketch_size = get_sketch_size(minhash_error)
+        jaccard = estimate_jaccard_matrix(
+            get_sketches(planes1, sketch_size), get_sketches(planes2, sketch_size)
+        )
+        jaccard[~mask] = np.nan
+        return jaccard
+
+    intersection = None
+    if backend == "contingency":
+        intersection = get_intersection_matrix(planes1, planes2)
+    if intersection is None:
+        get_pair_jaccard = get_pair_jaccard_function(backend)
+        jaccard = np.full(shape, np.nan)
+        for i, j in zip(*np.nonzero(mask)):
+            jaccard[i, j] = get_pair_jaccard(planes1[i], planes2[j])
+        return jaccard
+
+    union = (
+        get_sizes(planes1)[:, np.newaxis] + get_sizes(planes2)[np.newaxis, :]
+    ) - intersection
+    jaccard = np.divide(intersection, union, out=np.full(shape, np.nan), where=mask)
+    return jaccard
+
+
+def get_angle_cos_matrix(
+    planes1: Sequence[Plane], planes2: Sequence[Plane]
+) -> np.ndarray:
+    """
+    Calculates cosines of angles between normals for all pairs of planes
+    :return: Matrix of shape (len(planes1), len(planes2))
+    """
+    normals1 = get_equations(planes1)[:, :3]
+    normals2 = get_equations(planes2)[:, :3]
+    norms = np.outer(np.linalg.norm(normals1, axis=1), np.linalg.norm(normals2, axis=1))
+    return (normals1 @ normals2.T) / norms
+
+
+def get_distance_matrix(
+    planes1: Sequence[Plane], planes2: Sequence[Plane]
+) -> np.ndarray:
+    """
+    Calculates differences between distances from the origin for all pairs of planes
+    :return: Matrix of shape (len(planes1), len(planes2))
+    """
+    d1 = get_equations(planes1)[:, -1]
+    d2 = get_equations(planes2)[:, -1]
+    return np.abs(d1[:, np.newaxis] - d2[np.newaxis, :])
@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from association.assoc_methods.assoc_method import AssocMethod
+from association.assoc_methods.jaccard_thresholded import JaccardThresholded
+from association.assoc_methods.jaccard_weighed import JaccardWeighed
+from association.matching import match_greedy
+from cloud_processing.annotator import get_planes_labeled
+from cloud_processing.down_sample import down_sample
+from cloud_processing.loader import Loader
+from cloud_processing.synthetic_loader import SyntheticLoader
+
+# Stages of one frame and of association of one frames pair
+FRAME_STAGES = ["load", "annotate", "downsample", "fit"]
+PAIR_STAGES = ["score", "match"]
+STAGES = FRAME_STAGES + PAIR_STAGES
+PERCENTILES = [50, 95, 99]
+
+
+def measure(
+    function: Callable,
+    repetitions: int,
+    warmup: int = 1,
+    setup: Optional[Callable] = None,
+) -> Tuple[List[int], object]:
+    """
+    Times function with perf_counter_ns after warmup runs
+    :param function: Function without arguments, or of the setup result
+    :param repetitions: Number of timed runs
+    :param warmup: Number of runs before timing
+    :param setup: Untimed function called before each run, its result
+        is passed to the function, so runs don't reuse state of previous ones
+    :return: Time of each timed run in nanoseconds and result of the last run
+    """
+    run = function if setup is None else lambda: function(setup())
+    result = None
+    for _ in range(warmup):
+        result = run()
+    times = []
+    for _ in range(repetitions):
+        arguments = () if setup is None else (setup(),)
+        start = time.perf_counter_ns()
+        result = function(*arguments)
+        times.append(time.perf_counter_ns() - start)
+    return times, result
+
+
+def run_benchmark(
+    methods: List[Tuple[AssocMethod, float, int]],
+    loader: Loader,
+    repetitions: int = 10,
+    warmup: int = 1,
+    stride: int = 10,
+    pairs_count: Optional[int] = None,
+) -> dict:
+    """
+    Times every stage of association separately for frames pairs (i, i + 1)
+    with given stride. Frame stages are timed for both frames of a pair,
+    files of the frame are in the OS cache after the warmup runs
+    :param methods: Methods with voxel_size and sample_rate for down sample
+    :param loader: Loader of the sequence, its cache isn't used
+    :param repetitions: Number of timed runs of each stage
+    :param warmup: Number of untimed runs of each stage before timing
+    :param stride: Step between first frames of pairs
+    :param pairs_count: Limit of number of pairs, all pairs by default
+    :return: Report with environment, parameters and statistics of stages
+    """
+    first_frames = range(0, loader.get_frames_count() - 1, stride)[:pairs_count]
+    results = {}
+    for method, voxel_size, sample_rate in methods:
+        samples = {stage: [] for stage in STAGES}
+        for frame_num in first_frames:
+            prev_planes, cur_planes = [
+                __measure_frame(
+                    loader,
+                    frame_num + shift,
+                    voxel_size,
+                    sample_rate,
+                    repetitions,
+                    warmup,
+                    samples,
+                )
+                for shift in [0, 1]
+            ]
+
+            # Point labels and sketches of planes are built by scoring as well
+            times, scores = measure(
+                lambda planes: method.get_result_matrix(*planes),
+                repetitions,
+                warmup,
+                lambda: (prev_planes.without_derived(), cur_planes.without_derived()),
+            )
+            samples["score"] += times
+            times, _ = measure(lambda: match_greedy(scores.T), repetitions, warmup)
+            samples["match"] += times
+
+        name = f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+        results[name] = {
+            stage: get_statistics(stage_samples)
+            for stage, stage_samples in samples.items()
+        }
+
+    return {
+        "environment": get_environment(),
+        "parameters": {
+            "repetitions": repetitions,
+            "warmup": warmup,
+            "stride": stride,
+            "pairs": len(first_frames),
+            "dtype": np.dtype(loader.dtype).name,
+        },
+        "results": results,
+    }
+
+
+def run_scaling(
+    methods: List[Tuple[AssocMethod, float, int]],
+    planes_counts: List[int],
+    resolutions: List[Tuple[int, int]],
+    repetitions: int = 10,
+    warmup: int = 1,
+    pairs_count: int = 3,
+    seed: int = 0,
+    dtype: type = np.float64,
+) -> dict:
+    """
+    Benchmarks stages on synthetic scenes of every plane count and resolution,
+    so curves of time over number of planes and of points can be drawn.
+    Results are named with the scene, so reports can be compared as well
+    :param methods: Methods with voxel_size and sample_rate for down sample
+    :param planes_counts: Numbers of planes in the scene
+    :param resolutions: Width and height of depth images
+    :param repetitions: Number of timed runs of each stage
+    :param warmup: Number of untimed runs of each stage before timing
+    :param pairs_count: Number of consecutive frames pairs of each scene
+    :param seed: Seed of the scenes
+    :param dtype: Type of points and plane geometry
+    :return: Report with environment, parameters and statistics of stages
+    """
+    results = {}
+    for planes_count in planes_counts:
+        for width, height in resolutions:
+            loader = SyntheticLoader(
+                planes_count,
+                width,
+                height,
+                frames_count=pairs_count + 1,
+                seed=seed,
+                dtype=dtype,
+            )
+            report = run_benchmark(
+                methods, loader, repetitions, warmup, stride=1, pairs_count=pairs_count
+            )
+            for name, stages in report["results"].items():
+                results[f"{name}_p{planes_count}_{width}x{height}"] = stages
+
+    return {
+        "environment": get_environment(),
+        "parameters": {
+            "repetitions": repetitions,
+            "warmup": warmup,
+            "pairs": pairs_count,
+            "seed": seed,
+            "dtype": np.dtype(dtype).name,
+            "planes_counts": planes_counts,
+            "resolutions": [f"{width}x{height}" for width, height in resolutions],
+        },
+        "results": results,
+    }
+
+
+def __measure_frame(
+    loader: Loader,
+    frame_num: int,
+    voxel_size: float,
+    sample_rate: int,
+    repetitions: int,
+    warmup: int,
+    samples: Dict[str, List[int]],
+):
+    times, (points, pixel_indices) = measure(
+        lambda: loader.load_points(frame_num), repetitions, warmup
+    )
+    samples["load"] += times
+    times, labels = measure(
+        lambda: loader.load_frame_labels(frame_num, pixel_indices), repetitions, warmup
+    )
+    samples["annotate"] += times
+    times, (points, labels, pixel_indices, pixel_offsets) = measure(
+        lambda: down_sample(points, labels, voxel_size, sample_rate, pixel_indices),
+        repetitions,
+        warmup,
+    )
+    samples["downsample"] += times
+    times, planes = measure(
+        lambda: get_planes_labeled(
+            points, labels, loader.with_bitmask, pixel_indices, pixel_offsets
+        ),
+        repetitions,
+        warmup,
+    )
+    samples["fit"] += times
+    return planes
+
+
+def get_statistics(times: List[int]) -> dict:
+    """
+    :param times: Times of runs in nanoseconds
+    :return: Mean and percentiles in milliseconds and throughput in runs per second
+    """
+    times_ms = np.asarray(times, dtype=float) / 1e6
+    statistics = {"samples": len(times), "mean_ms": float(times_ms.mean())}
+    for percentile in PERCENTILES:
+        statistics[f"p{percentile}_ms"] = float(np.percentile(times_ms, percentile))
+    statistics["throughput_per_s"] = float(1e3 / times_ms.mean())
+    return statistics
+
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(
+    baseline: dict, current: dict, threshold: float = 0.1, statistic: str = "p50_ms"
+) -> List[str]:
+    """
+    Compares stages of methods present in both reports
+    :param baseline: Stored report
+    :param current: New report
+    :param threshold: Allowed relative slowdown
+    :param statistic: Compared statistic of stages
+    :return: Descriptions of regressions
+    """
+    regressions = []
+    for name, stages in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        for stage, statistics in stages.items():
+            if stage not in baseline["results"][name]:
+                continue
+            old = baseline["results"][name][stage][statistic]
+            new = statistics[statistic]
+            change = new / old - 1 if old > 0 else 0
+            line = f"{name} {stage}: {old:.3f} -> {new:.3f} ms ({change:+.1%})"
+            print(("REGRESSION " if change > threshold else "") + line)
+            if change > threshold:
+                regressions.append(line)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Benchmark stages of association")
+    run_parser.add_argument("path_to_depth")
+    run_parser.add_argument("path_to_labeled_images")
+    run_parser.add_argument("config_path")
+    run_parser.add_argument("depth_format")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--repetitions", type=int, default=10)
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("--stride", type=int, default=10)
+    run_parser.add_argument("--pairs", type=int, default=None)
+    run_parser.add_argument("--float32", action="store_true")
+
+    scaling_parser = subparsers.add_parser(
+        "scaling", help="Benchmark stages on synthetic scenes of growing size"
+    )
+    scaling_parser.add_argument("--output", default="scaling.json")
+    scaling_parser.add_argument(
+        "--planes", type=int, nargs="+", default=[10, 50, 100, 200]
+    )
+    scaling_parser.add_argument(
+        "--resolutions", nargs="+", default=["640x480", "1280x720", "1920x1080"]
+    )
+    scaling_parser.add_argument("--repetitions", type=int, default=5)
+    scaling_parser.add_argument("--warmup", type=int, default=1)
+    scaling_parser.add_argument("--pairs", type=int, default=3)
+    scaling_parser.add_argument("--seed", type=int, default=0)
+    scaling_parser.add_argument("--float32", action="store_true")
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Flag regressions against stored baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument("--statistic", default="p50_ms")
+    args = parser.parse_args()
+
+    methods = [(JaccardWeighed(), 0, 1), (JaccardThresholded(), 0, 1)]
+    if args.command == "run":
+        from main import create_loader
+
+        loader = create_loader(
+            args.path_to_depth,
+            args.path_to_labeled_images,
+            args.config_path,
+            args.depth_format,
+            np.float32 if args.float32 else np.float64,
+        )
+        report = run_benchmark(
+            methods, loader, args.repetitions, args.warmup, args.stride, args.pairs
+        )
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    elif args.command == "scaling":
+        report = run_scaling(
+            methods,
+            args.planes,
+            [tuple(map(int, resolution.split("x"))) for resolution in args.resolutions],
+            args.repetitions,
+            args.warmup,
+            args.pairs,
+            args.seed,
+            np.float32 if args.float32 else np.float64,
+        )
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        with open(args.baseline) as file:
+            baseline_report = json.load(file)
+        with open(args.current) as file:
+            current_report = json.load(file)
+        if compare(baseline_report, current_report, args.threshold, args.statistic):
+            sys.exit(1)
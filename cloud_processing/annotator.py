@@ -1,57 +1,113 @@
-from typing import List
+from typing import Optional
 
 import cv2
 import numpy as np
-import open3d as o3d
 
+from cloud_processing.down_sample import NOT_PLANE, UNLABELED, select_sources
 from dto.plane import Plane
+from dto.plane_set import PlaneSet
 
 
-def get_planes_labeled(pcd: o3d.geometry.PointCloud) -> List[Plane]:
-    planes = []
+def get_planes_labeled(
+    points: np.ndarray,
+    labels: np.ndarray,
+    with_bitmask: bool = False,
+    pixel_indices: Optional[np.ndarray] = None,
+    pixel_offsets: Optional[np.ndarray] = None,
+) -> PlaneSet:
+    """
+    Extracts planes from labeled points
+    :param points: Points of shape (N, 3)
+    :param labels: Plane label of each point, labels with NOT_PLANE bit
+        such as UNLABELED are not planes
+    :param with_bitmask: Pack plane membership into bitmasks for popcount IoU
+    :param pixel_indices: Source pixels of points, planes store pixel indices
+        instead of point indices if they are given
+    :param pixel_offsets: Start of each point in pixel_indices,
+        one pixel for each point by default
+    :return: Planes ordered by label
+    """
+    unique_labels, label_ids = np.unique(labels, return_inverse=True)
+    label_ids = label_ids.reshape(-1)
+    is_plane_label = (unique_labels & NOT_PLANE) == 0
+    plane_labels = unique_labels[is_plane_label]
+    plane_of_label = np.full(len(unique_labels), -1)
+    plane_of_label[is_plane_label] = np.arange(len(plane_labels))
+    point_planes = plane_of_label[label_ids]
 
-    colors_unique = np.unique(pcd.colors, axis=0)
-    unique_colors_without_black = list(
-        filter(lambda x: (x != [0, 0, 0]).all(axis=0), colors_unique)
+    # Single stable sort groups points of all planes keeping their order
+    labeled_points = np.flatnonzero(point_planes != -1)
+    order = labeled_points[np.argsort(point_planes[labeled_points], kind="stable")]
+    point_offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(point_planes[order], minlength=len(plane_labels)))]
     )
+    plane_points = points[order]
 
-    for color in unique_colors_without_black:
-        indices = np.where((pcd.colors == color).all(axis=1))[0]
-        plane_points = np.asarray(pcd.points)[indices]
-        equation = Plane.get_normal(plane_points)
-        planes.append(Plane(plane_points, indices, equation, color))
+    if pixel_offsets is not None:
+        indices, order_offsets = select_sources(pixel_indices, pixel_offsets, order)
+        offsets = order_offsets[point_offsets]
+    else:
+        indices = order if pixel_indices is None else pixel_indices[order]
+        offsets = point_offsets
+
+    equations = Plane.get_normals(plane_points, point_offsets, points.dtype)
+    planes = PlaneSet(
+        plane_points,
+        indices,
+        offsets,
+        equations,
+        get_label_colors(plane_labels, points.dtype),
+        plane_labels,
+        point_offsets,
+    )
+    if with_bitmask:
+        planes.pack_bitmasks()
 
     return planes
 
 
-def annotate(annotation_path: str, pcd: o3d.geometry.PointCloud):
+def load_labels(
+    annotation_path: str, pixel_indices: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Loads plane labels that are the same for a plane in all frames.
+    Colors of labeled image are packed into integers, colors with a zero channel
+    are not planes and have NOT_PLANE bit. .npy labels are taken as is
+    :param annotation_path: Path to labeled image or .npy labels
+    :param pixel_indices: Pixel index of each point, points are pixels by default
+    :return: uint32 label of each point, UNLABELED for points without plane
+    """
     if annotation_path.endswith(".npy"):
-        __annotate_with_npy(annotation_path, pcd)
+        labels = __load_labels_from_npy(annotation_path)
     else:
-        __annotate_with_rgb(annotation_path, pcd)
-
-
-def __annotate_with_rgb(annotation_path: str, pcd: o3d.geometry.PointCloud):
-    annotation_rgb = cv2.imread(annotation_path)
-    colors = (
-        annotation_rgb.reshape((annotation_rgb.shape[0] * annotation_rgb.shape[1], 3))
-    ) / 255
-    pcd.colors = o3d.utility.Vector3dVector(colors)
-
-
-def __annotate_with_npy(annotation_path: str, pcd: o3d.geometry.PointCloud):
-    annot_of_image = np.load(annotation_path)
-    annot_unique = np.unique(annot_of_image, axis=0)
-    colors = np.empty((len(pcd.points), 3))
-    unique_colors = {(0, 0, 0)}
-    for annot_num in annot_unique:
-        indices = np.where(annot_of_image == annot_num)[0]
-        if annot_num == 1:
-            colors[indices] = [0, 0, 0]
-            continue
-        unique_color = np.random.random(3)
-        while tuple(unique_color) in unique_colors:
-            unique_color = np.random.random(3)
-        colors[indices] = unique_color
-        unique_colors.add(tuple(unique_color))
-    pcd.colors = o3d.utility.Vector3dVector(colors)
+        labels = __load_labels_from_rgb(annotation_path)
+    if pixel_indices is not None:
+        labels = labels[pixel_indices]
+    return labels
+
+
+def get_label_colors(labels: np.ndarray, dtype: type = np.float64) -> np.ndarray:
+    """
+    Unpacks labels into colors, for labeled images they are colors of planes
+    :return: Colors in [0, 1] of shape (len(labels), 3)
+    """
+    channels = [(labels >> shift) & 255 for shift in [16, 8, 0]]
+    return (np.stack(channels, axis=-1).reshape((-1, 3)) / 255).astype(dtype)
+
+
+def __load_labels_from_rgb(annotation_path: str) -> np.ndarray:
+    annotation_rgb = cv2.imread(annotation_path).reshape((-1, 3)).astype(np.uint32)
+    labels = (
+        (annotation_rgb[:, 0] << 16)
+        | (annotation_rgb[:, 1] << 8)
+        | annotation_rgb[:, 2]
+    )
+    labels[(annotation_rgb == 0).any(axis=1)] |= NOT_PLANE
+    labels[labels == NOT_PLANE] = UNLABELED
+    return labels
+
+
+def __load_labels_from_npy(annotation_path: str) -> np.ndarray:
+    labels = np.load(annotation_path).reshape(-1).astype(np.uint32)
+    labels[labels == 1] = UNLABELED
+    return labels
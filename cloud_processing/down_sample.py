@@ -1,25 +1,120 @@
-import copy
+from typing import Optional, Tuple
 
 import numpy as np
-import open3d as o3d
 
+# Label of points without plane, the largest label, so it never collides with colors
+UNLABELED = np.iinfo(np.uint32).max
+# Bit of labels that are not planes, colors with a zero channel keep their own
+# labels with this bit, so they are voted apart, UNLABELED has it as well
+NOT_PLANE = 1 << 24
 
-def down_sample(pcd: o3d.geometry.PointCloud, voxel_size: float, sample_rate: int):
-    colors_copy = copy.deepcopy(pcd.colors)
 
-    def get_color(index_vector_raw):
-        index_vector = np.delete(index_vector_raw, np.where(index_vector_raw == -1))
-        color_vector = [colors_copy[index] for index in index_vector]
-        pairs, counts = np.unique(color_vector, axis=0, return_counts=True)
-        return pairs[counts.argmax()]
+def down_sample(
+    points: np.ndarray,
+    labels: np.ndarray,
+    voxel_size: float,
+    sample_rate: int,
+    pixel_indices: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Down samples labeled points with voxel grid and then uniformly
+    :param points: Points of shape (N, 3)
+    :param labels: Plane label of each point
+    :param voxel_size: Size of voxel, 0 disables voxel down sample
+    :param sample_rate: Rate for uniform down sample
+    :param pixel_indices: Pixel index of each point, points are pixels by default
+    :return: Down sampled points, their labels and source pixels, pixels of
+        point i are pixel_indices[pixel_offsets[i]:pixel_offsets[i + 1]]
+    """
+    if pixel_indices is None:
+        pixel_indices = np.arange(len(points))
+    pixel_offsets = np.arange(len(points) + 1)
 
-    if voxel_size != 0:
-        pcd, indices, s = pcd.voxel_down_sample_and_trace(
-            voxel_size, pcd.get_min_bound(), pcd.get_max_bound()
+    if voxel_size != 0 and len(points) != 0:
+        points, labels, pixel_indices, pixel_offsets = voxel_down_sample(
+            points, labels, voxel_size, pixel_indices
         )
-        pcd.colors = o3d.utility.Vector3dVector(
-            np.apply_along_axis(get_color, 1, indices)
-        )
-    pcd = pcd.uniform_down_sample(sample_rate)
+    sampled_points = np.arange(0, len(points), sample_rate)
+    pixel_indices, pixel_offsets = select_sources(
+        pixel_indices, pixel_offsets, sampled_points
+    )
+
+    return (
+        points[sampled_points],
+        labels[sampled_points],
+        pixel_indices,
+        pixel_offsets,
+    )
+
+
+def voxel_down_sample(
+    points: np.ndarray,
+    labels: np.ndarray,
+    voxel_size: float,
+    pixel_indices: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Replaces points of each voxel with their centroid labeled with the most
+    frequent label of these points. Equal counts are resolved as for colors:
+    UNLABELED is taken first as black and then the smallest color
+    :param points: Points of shape (N, 3)
+    :param labels: Integer label of each point
+    :param voxel_size: Size of voxel
+    :param pixel_indices: Pixel index of each point
+    :return: Voxel centroids, their labels and pixels of each voxel
+        as pixel indices with offsets of voxels
+    """
+    coordinates = np.floor((points - points.min(axis=0)) / voxel_size).astype(np.int64)
+    keys = np.ravel_multi_index(coordinates.T, coordinates.max(axis=0) + 1)
+    _, voxel_ids, voxel_sizes = np.unique(keys, return_inverse=True, return_counts=True)
+    voxel_ids = voxel_ids.reshape(-1)
+    voxels_count = len(voxel_sizes)
+
+    centroids = np.column_stack(
+        [
+            np.bincount(voxel_ids, weights=points[:, axis], minlength=voxels_count)
+            for axis in range(3)
+        ]
+    )
+    centroids /= voxel_sizes[:, np.newaxis]
+    centroids = centroids.astype(points.dtype, copy=False)
+
+    unique_labels, label_ids = np.unique(labels, return_inverse=True)
+    labels_count = len(unique_labels)
+    pairs, pair_counts = np.unique(
+        voxel_ids * labels_count + label_ids.reshape(-1), return_counts=True
+    )
+    pair_voxels, pair_labels = np.divmod(pairs, labels_count)
+    label_ranks = np.where(
+        unique_labels & NOT_PLANE, unique_labels & (NOT_PLANE - 1), unique_labels
+    ).astype(np.int64)
+    label_ranks[unique_labels == UNLABELED] = -1
+    # The first pair of each voxel has the largest count and the smallest rank
+    order = np.lexsort((label_ranks[pair_labels], -pair_counts, pair_voxels))
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = pair_voxels[order][1:] != pair_voxels[order][:-1]
+    voxel_labels = unique_labels[pair_labels[order][is_first]]
+
+    points_order = np.argsort(voxel_ids, kind="stable")
+    voxel_offsets = np.concatenate([[0], np.cumsum(voxel_sizes)])
+
+    return centroids, voxel_labels, pixel_indices[points_order], voxel_offsets
+
 
-    return pcd
+def select_sources(
+    pixel_indices: np.ndarray, pixel_offsets: np.ndarray, points: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Selects source pixels of given points
+    :param pixel_indices: Pixel indices of all points
+    :param pixel_offsets: Start of each point in pixel_indices
+    :param points: Indices of points to select
+    :return: Pixel indices of selected points and their offsets
+    """
+    starts = pixel_offsets[points]
+    sizes = pixel_offsets[points + 1] - starts
+    selected_offsets = np.concatenate([[0], np.cumsum(sizes)])
+    positions = np.arange(selected_offsets[-1]) + np.repeat(
+        starts - selected_offsets[:-1], sizes
+    )
+    return pixel_indices[positions], selected_offsets
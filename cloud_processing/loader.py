@@ -1,22 +1,34 @@
 import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import open3d as o3d
 
-from cloud_processing.annotator import annotate, get_planes_labeled
+from cloud_processing.annotator import get_planes_labeled, load_labels
 from cloud_processing.down_sample import down_sample
+from cloud_processing.loaders.depth_projector import DepthProjector
 from cloud_processing.loaders.icl_raw_loader import (
+    get_icl_raw_projector,
     icl_raw_depth_dir_sort_func,
-    icl_raw_depth_to_pcd_custom,
+    read_icl_raw_depth,
 )
+from cloud_processing.plane_cache import CacheKey, PlaneCache
 from cloud_processing.loaders.tum_loader import (
     icl_depth_dir_sort_func,
     tum_depth_dir_sort_func,
-    depth_to_pcd_custom,
+    get_projector,
+    read_depth_image,
 )
-from dto.plane import Plane
+from dto.plane_set import PlaneSet
+from tracing import TRACER
 
 
 class Loader:
+    # Loaders of sequences stored as back-projected points have no depth images,
+    # they override load_points instead of read_depth
+    has_depth = True
+
     def __init__(
         self,
         depth_path: str,
@@ -26,6 +38,11 @@ class Loader:
         depth_scale: int,
         voxel_size: float = 0,
         sample_rate: int = 1,
+        with_bitmask: bool = False,
+        cache_memory_limit: int = 2**30,
+        cache_dir: Optional[str] = None,
+        drop_invalid: bool = False,
+        dtype: type = np.float64,
     ):
         """
         Class for loading planes from raw data
@@ -36,6 +53,13 @@ class Loader:
         :param depth_scale: The depth is scaled by 1 / depth_scale
         :param voxel_size: Size of voxel for down sample
         :param sample_rate: Rate for down sample
+        :param with_bitmask: Pack plane membership into bitmasks for popcount IoU
+        :param cache_memory_limit: Memory limit for cached planes in bytes, 0 disables it
+        :param cache_dir: Directory for persistent planes cache
+        :param drop_invalid: Drop pixels without depth before processing,
+            planes keep pixel indices, so IoU is consistent between frames
+        :param dtype: Type of points and plane geometry in all stages,
+            float32 halves memory and bandwidth of point data
         """
         self.depth_path = depth_path
         self.annot_path = annot_path
@@ -44,6 +68,10 @@ class Loader:
         self.depth_scale = depth_scale
         self.voxel_size = voxel_size
         self.sample_rate = sample_rate
+        self.with_bitmask = with_bitmask
+        self.cache = PlaneCache(cache_memory_limit, cache_dir)
+        self.drop_invalid = drop_invalid
+        self.dtype = dtype
 
         self.annot_images = os.listdir(annot_path)
 
@@ -63,6 +91,23 @@ class Loader:
             self.depth_images.sort(key=icl_raw_depth_dir_sort_func)
             self.annot_images.sort(key=icl_raw_depth_dir_sort_func)
 
+    def __getstate__(self):
+        # Open3D intrinsics can't be pickled, so they are passed to processes as values
+        state = self.__dict__.copy()
+        state["intrinsics"] = (
+            self.intrinsics.width,
+            self.intrinsics.height,
+            self.intrinsics.intrinsic_matrix[0, 0],
+            self.intrinsics.intrinsic_matrix[1, 1],
+            self.intrinsics.intrinsic_matrix[0, 2],
+            self.intrinsics.intrinsic_matrix[1, 2],
+        )
+        return state
+
+    def __setstate__(self, state):
+        state["intrinsics"] = o3d.camera.PinholeCameraIntrinsic(*state["intrinsics"])
+        self.__dict__.update(state)
+
     def get_frames_count(self) -> int:
         return len(self.depth_images)
 
@@ -70,25 +115,225 @@ class Loader:
         self.voxel_size = voxel_size
         self.sample_rate = sample_rate
 
-    def get_planes_for_frame(self, frame_num: int) -> [Plane]:
+    def get_planes_for_frame(self, frame_num: int) -> PlaneSet:
         """
         Creates PointCloud from depth image, then extracts planes with labeled images
         :param frame_num: index of frame in dataset
         :return: Planes from PointCloud
         """
+        with TRACER.span("get_planes_for_frame", frame=frame_num) as span:
+            cache_key = self.__get_cache_key(
+                frame_num, self.voxel_size, self.sample_rate
+            )
+            sources = self.get_source_paths(frame_num)
+            planes = self.cache.get(cache_key, sources)
+            span.set(cached=planes is not None)
+            if planes is None:
+                planes = self.__extract_planes(frame_num)
+                self.cache.put(cache_key, planes, sources)
+            elif self.with_bitmask and planes.bitmasks is None:
+                planes.pack_bitmasks()
+                self.cache.put(cache_key, planes, sources)
+            span.set(planes=len(planes))
+
+        return planes
+
+    def iter_frame_pairs(
+        self,
+        stride: int = 1,
+        prefetch: int = 2,
+        executor: Optional[Executor] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> Iterator[Tuple[PlaneSet, PlaneSet]]:
+        """
+        Iterates over planes of frames pairs (i, i + 1) for i with given stride.
+        Upcoming frames are prepared in background, so loading overlaps
+        with processing of the current pair. Only prefetch pairs ahead are
+        prepared, so memory stays bounded on long sequences
+        :param stride: Step between first frames of consecutive pairs
+        :param prefetch: Number of pairs prepared ahead, 0 disables prefetching
+        :param executor: Executor for loading frames, thread pool by default
+        :param start: First frame of the first pair
+        :param stop: Bound for first frames of pairs, the last possible pair by default
+        :return: Iterator over (prev_planes, cur_planes)
+        """
+        if stop is None:
+            stop = self.get_frames_count() - 1
+        first_frames = range(start, min(stop, self.get_frames_count() - 1), stride)
+        if prefetch == 0:
+            for frame_num in first_frames:
+                prev_planes = self.get_planes_for_frame(frame_num)
+                yield prev_planes, self.get_planes_for_frame(frame_num + 1)
+            return
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=prefetch)
+        futures = {}
+
+        def submit_pair(pair_index: int):
+            if pair_index >= len(first_frames):
+                return
+            for frame_num in [first_frames[pair_index], first_frames[pair_index] + 1]:
+                if frame_num not in futures:
+                    futures[frame_num] = executor.submit(
+                        self.get_planes_for_frame, frame_num
+                    )
+
+        try:
+            for pair_index in range(prefetch + 1):
+                submit_pair(pair_index)
+            for pair_index, frame_num in enumerate(first_frames):
+                prev_planes = futures[frame_num].result()
+                cur_planes = futures[frame_num + 1].result()
+                for stale_frame_num in [
+                    key for key in futures.keys() if key <= frame_num
+                ]:
+                    del futures[stale_frame_num]
+                yield prev_planes, cur_planes
+                submit_pair(pair_index + prefetch + 1)
+        finally:
+            for future in futures.values():
+                future.cancel()
+            if own_executor:
+                executor.shutdown()
+
+    def load_points(self, frame_num: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Reads depth image of the frame and back-projects it.
+        Points are in the buffer of the calling thread until its next projection
+        :param frame_num: index of frame in dataset
+        :return: Points and pixel index of each point if invalid pixels are dropped
+        """
+        depth, projector = self.read_depth(frame_num)
+        with TRACER.span("project", frame=frame_num, pixels=depth.size):
+            return projector.project(depth, self.drop_invalid)
+
+    def read_depth(self, frame_num: int) -> Tuple[np.ndarray, DepthProjector]:
+        """
+        Reads depth image of the frame
+        :param frame_num: index of frame in dataset
+        :return: Depth image and projector of its camera
+        """
         depth_image_path = os.path.join(self.depth_path, self.depth_images[frame_num])
+        with TRACER.span("read_depth", frame=frame_num):
+            if self.depth_format != "icl_raw":
+                projector = get_projector(self.intrinsics, self.depth_scale, self.dtype)
+                depth = read_depth_image(depth_image_path)
+            else:
+                projector = get_icl_raw_projector(
+                    depth_image_path, self.intrinsics, self.depth_scale, self.dtype
+                )
+                depth = read_icl_raw_depth(depth_image_path, self.intrinsics)
+        return depth, projector
+
+    def load_frame_labels(
+        self, frame_num: int, pixel_indices: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Loads plane labels of the frame points
+        :param frame_num: index of frame in dataset
+        :param pixel_indices: Pixel index of each point, points are pixels by default
+        :return: Label of each point
+        """
         annot_image_path = os.path.join(self.annot_path, self.annot_images[frame_num])
-        if self.depth_format != "icl_raw":
-            pcd = depth_to_pcd_custom(
-                depth_image_path, self.intrinsics, self.depth_scale
+        return load_labels(annot_image_path, pixel_indices)
+
+    def get_source_paths(self, frame_num: int) -> List[str]:
+        """
+        :param frame_num: index of frame in dataset
+        :return: Paths of files the frame is read from, they identify cached planes
+        """
+        return [
+            os.path.join(self.depth_path, self.depth_images[frame_num]),
+            os.path.join(self.annot_path, self.annot_images[frame_num]),
+        ]
+
+    def get_planes_for_levels(
+        self, frame_num: int, levels: List[Tuple[float, int]]
+    ) -> Dict[Tuple[float, int], PlaneSet]:
+        """
+        Extracts planes of the frame for several down sample parameters.
+        The frame is loaded once and each level missing in the cache is derived
+        from it, all levels are put into the cache
+        :param frame_num: index of frame in dataset
+        :param levels: Pairs of voxel_size and sample_rate
+        :return: Planes of each level
+        """
+        planes = {}
+        sources = self.get_source_paths(frame_num)
+        for voxel_size, sample_rate in levels:
+            cache_key = self.__get_cache_key(frame_num, voxel_size, sample_rate)
+            level_planes = self.cache.get(cache_key, sources)
+            if level_planes is not None:
+                if self.with_bitmask and level_planes.bitmasks is None:
+                    level_planes.pack_bitmasks()
+                    self.cache.put(cache_key, level_planes, sources)
+                planes[(voxel_size, sample_rate)] = level_planes
+
+        missing_levels = [
+            level for level in dict.fromkeys(levels) if level not in planes
+        ]
+        if len(missing_levels) != 0:
+            points, labels, pixel_indices = self.__load_frame(frame_num)
+            for voxel_size, sample_rate in missing_levels:
+                planes[(voxel_size, sample_rate)] = self.__derive_planes(
+                    frame_num, points, labels, pixel_indices, voxel_size, sample_rate
+                )
+                self.cache.put(
+                    self.__get_cache_key(frame_num, voxel_size, sample_rate),
+                    planes[(voxel_size, sample_rate)],
+                    sources,
+                )
+        return planes
+
+    def __get_cache_key(
+        self, frame_num: int, voxel_size: float, sample_rate: int
+    ) -> CacheKey:
+        # Type and dropped pixels change planes as well as down sample parameters
+        return (
+            frame_num,
+            voxel_size,
+            sample_rate,
+            np.dtype(self.dtype).name,
+            self.drop_invalid,
+        )
+
+    def __extract_planes(self, frame_num: int) -> PlaneSet:
+        points, labels, pixel_indices = self.__load_frame(frame_num)
+        return self.__derive_planes(
+            frame_num, points, labels, pixel_indices, self.voxel_size, self.sample_rate
+        )
+
+    def __load_frame(
+        self, frame_num: int
+    ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        with TRACER.span("load", frame=frame_num) as span:
+            points, pixel_indices = self.load_points(frame_num)
+            span.set(points=len(points))
+        with TRACER.span("annotate", frame=frame_num, points=len(points)):
+            labels = self.load_frame_labels(frame_num, pixel_indices)
+        return points, labels, pixel_indices
+
+    def __derive_planes(
+        self,
+        frame_num: int,
+        points: np.ndarray,
+        labels: np.ndarray,
+        pixel_indices: Optional[np.ndarray],
+        voxel_size: float,
+        sample_rate: int,
+    ) -> PlaneSet:
+        with TRACER.span("down_sample", frame=frame_num) as span:
+            points, labels, pixel_indices, pixel_offsets = down_sample(
+                points, labels, voxel_size, sample_rate, pixel_indices
             )
-        else:
-            pcd = icl_raw_depth_to_pcd_custom(
-                depth_image_path, self.intrinsics, self.depth_scale
+            span.set(points=len(points))
+        with TRACER.span("fit", frame=frame_num, points=len(points)) as span:
+            planes = get_planes_labeled(
+                points, labels, self.with_bitmask, pixel_indices, pixel_offsets
             )
-        annotate(annot_image_path, pcd)
-        pcd = down_sample(pcd, self.voxel_size, self.sample_rate)
-        # o3d.visualization.draw_geometries([pcd])
-        planes = get_planes_labeled(pcd)
+            span.set(planes=len(planes))
 
         return planes
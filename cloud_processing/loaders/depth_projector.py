@@ -0,0 +1,93 @@
+import threading
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class DepthProjector:
+    def __init__(self, rays: np.ndarray):
+        """
+        Back-projects depth images of one camera.
+        Point of the pixel is its ray multiplied by its depth value
+        :param rays: Ray of each pixel in row-major order scaled by depth scale,
+            shape (W * H, 3)
+        """
+        self.rays = rays
+        self.__local = threading.local()
+
+    def __reduce__(self):
+        return DepthProjector, (self.rays,)
+
+    def project(
+        self, depth: np.ndarray, drop_invalid: bool = False
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Back-projects depth image into the buffer of the calling thread.
+        The buffer is reused by the next call from the same thread
+        :param depth: Depth image of shape (H, W) or flattened
+        :param drop_invalid: Skip pixels with zero or non-finite depth
+        :return: Points and pixel index of each point if invalid pixels are dropped
+        """
+        depth = depth.reshape(-1)
+        if not drop_invalid:
+            points = self.__get_buffer(len(depth))
+            np.multiply(self.rays, depth[:, np.newaxis], out=points)
+            return points, None
+
+        pixel_indices = np.flatnonzero(np.isfinite(depth) & (depth > 0))
+        points = self.__get_buffer(len(pixel_indices))
+        np.multiply(
+            self.rays[pixel_indices], depth[pixel_indices, np.newaxis], out=points
+        )
+        return points, pixel_indices
+
+    def __get_buffer(self, points_count: int) -> np.ndarray:
+        buffer = getattr(self.__local, "buffer", None)
+        if buffer is None:
+            buffer = np.empty_like(self.rays)
+            self.__local.buffer = buffer
+        return buffer[:points_count]
+
+
+def get_pinhole_rays(
+    width: int, height: int, fx: float, fy: float, cx: float, cy: float
+) -> np.ndarray:
+    """
+    Rays of pixels with unit z coordinate in row-major order
+    """
+    column_indices = np.tile(np.arange(width), height)
+    row_indices = np.repeat(np.arange(height), width)
+    rays = np.empty((width * height, 3))
+    rays[:, 0] = (column_indices - cx) / fx
+    rays[:, 1] = (row_indices - cy) / fy
+    rays[:, 2] = 1
+    return rays
+
+
+@lru_cache(maxsize=16)
+def get_depth_projector(
+    width: int,
+    height: int,
+    fx: float,
+    fy: float,
+    cx: float,
+    cy: float,
+    scale: float,
+    along_ray: bool = False,
+    flip: bool = False,
+    dtype: type = np.float64,
+) -> DepthProjector:
+    """
+    Returns projector for camera parameters, it is created once for each of them
+    :param scale: The depth is scaled by 1 / scale
+    :param along_ray: Depth is a distance along the ray instead of z coordinate
+    :param flip: Reflect points through the origin
+    :param dtype: Type of rays and projected points
+    """
+    rays = get_pinhole_rays(width, height, fx, fy, cx, cy)
+    if along_ray:
+        rays /= np.linalg.norm(rays, axis=1)[:, np.newaxis]
+    if flip:
+        rays = -rays
+    return DepthProjector((rays / scale).astype(dtype))
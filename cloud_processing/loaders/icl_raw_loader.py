@@ -1,47 +1,86 @@
 import math
+import os
+from functools import lru_cache
 
 import numpy as np
 import open3d as o3d
 
+from cloud_processing.loaders.depth_projector import DepthProjector, get_depth_projector
+
 
 def icl_raw_depth_dir_sort_func(filename: str):
     return int(filename.split(".")[0].split("_")[-1])
 
 
-def icl_raw_depth_to_pcd_custom(depth_image_path, intrinsics, scale):
-    # Adopted from https://www.doc.ic.ac.uk/~ahanda/VaFRIC/compute3Dpositions.m
-    fx, fy, cx, cy = __get_camera_params_for_frame(depth_image_path, intrinsics)
+def read_icl_raw_depth(depth_image_path, intrinsics) -> np.ndarray:
+    """
+    Reads depth of ICL NUIM raw frame, binary copy is used if it was converted
+    """
+    binary_path = get_icl_raw_binary_path(depth_image_path)
+    if os.path.exists(binary_path):
+        return np.load(binary_path)
+    return __parse_icl_raw_depth(depth_image_path, intrinsics.width * intrinsics.height)
+
+
+def get_icl_raw_binary_path(depth_image_path: str) -> str:
+    return depth_image_path + ".npy"
+
+
+def convert_icl_raw_sequence(depth_path: str, width: int, height: int) -> int:
+    """
+    Converts ASCII depth of all frames in the folder into binary float32 arrays,
+    which are read instead of ASCII depth afterwards
+    :param depth_path: Path to ICL NUIM raw sequence folder
+    :param width: Width of depth images
+    :param height: Height of depth images
+    :return: Number of converted frames
+    """
+    depth_images = list(filter(lambda x: x.endswith(".depth"), os.listdir(depth_path)))
+    for depth_image in depth_images:
+        depth_image_path = os.path.join(depth_path, depth_image)
+        depth_data = __parse_icl_raw_depth(depth_image_path, width * height)
+        np.save(
+            get_icl_raw_binary_path(depth_image_path), depth_data.astype(np.float32)
+        )
 
-    x_matrix = np.tile(np.arange(intrinsics.width), (intrinsics.height, 1)).flatten()
-    y_matrix = np.transpose(
-        np.tile(np.arange(intrinsics.height), (intrinsics.width, 1))
-    ).flatten()
-    x_modifier = (x_matrix - cx) / fx
-    y_modifier = (y_matrix - cy) / fy
+    return len(depth_images)
 
-    points = np.zeros((intrinsics.width * intrinsics.height, 3))
 
-    pcd = o3d.geometry.PointCloud()
+def __parse_icl_raw_depth(depth_image_path, values_count: int) -> np.ndarray:
     with open(depth_image_path, "r") as input_file:
-        data = input_file.read()
-        depth_data = np.asarray(
-            list(
-                map(
-                    lambda x: float(x),
-                    data.split(" ")[: intrinsics.height * intrinsics.width],
-                )
-            )
+        return np.fromstring(
+            input_file.read(), dtype=float, count=values_count, sep=" "
         )
-        # depth_data = depth_data.reshape((480, 640))
 
-        points[:, 2] = (
-            depth_data / np.sqrt(x_modifier**2 + y_modifier**2 + 1) / scale
-        )
-        points[:, 0] = x_modifier * points[:, 2]
-        points[:, 1] = y_modifier * points[:, 2]
 
-        pcd.points = o3d.utility.Vector3dVector(points)
-        pcd.transform([[-1, 0, 0, 0], [0, -1, 0, 0], [0, 0, -1, 0], [0, 0, 0, 1]])
+def get_icl_raw_projector(
+    depth_image_path, intrinsics, scale, dtype=np.float64
+) -> DepthProjector:
+    # Adopted from https://www.doc.ic.ac.uk/~ahanda/VaFRIC/compute3Dpositions.m
+    # Depth is a distance along the ray and points are reflected through the origin
+    fx, fy, cx, cy = __get_camera_params_for_sequence(
+        os.path.dirname(depth_image_path), intrinsics.width, intrinsics.height
+    )
+    return get_depth_projector(
+        intrinsics.width,
+        intrinsics.height,
+        fx,
+        fy,
+        cx,
+        cy,
+        scale,
+        along_ray=True,
+        flip=True,
+        dtype=dtype,
+    )
+
+
+def icl_raw_depth_to_pcd_custom(depth_image_path, intrinsics, scale):
+    projector = get_icl_raw_projector(depth_image_path, intrinsics, scale)
+    points, _ = projector.project(read_icl_raw_depth(depth_image_path, intrinsics))
+
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points)
 
     return pcd
 
@@ -65,7 +104,19 @@ def __load_camera_params_from_file(depth_image_path) -> dict:
         return result
 
 
-def __get_camera_params_for_frame(depth_image_path, intrinsics):
+@lru_cache(maxsize=None)
+def __get_camera_params_for_sequence(depth_path, width, height):
+    # Camera vectors of frames differ only by rounding of the rotated vectors,
+    # so intrinsics of the first frame are used for all frames and they share
+    # the projector instead of building rays for each frame
+    depth_images = filter(lambda x: x.endswith(".depth"), os.listdir(depth_path))
+    first_image = min(depth_images, key=icl_raw_depth_dir_sort_func)
+    return __get_camera_params_for_frame(
+        os.path.join(depth_path, first_image), width, height
+    )
+
+
+def __get_camera_params_for_frame(depth_image_path, width, height):
     # Adopted from https://www.doc.ic.ac.uk/~ahanda/VaFRIC/getcamK.m
     camera_params_raw = __load_camera_params_from_file(depth_image_path)
     cam_dir = np.fromstring(camera_params_raw["cam_dir"][1:-1], dtype=float, sep=",").T
@@ -77,8 +128,6 @@ def __get_camera_params_for_frame(depth_image_path, intrinsics):
     aspect = np.linalg.norm(cam_right) / np.linalg.norm(cam_up)
     angle = 2 * math.atan(np.linalg.norm(cam_right) / 2 / focal)
 
-    width = intrinsics.width
-    height = intrinsics.height
     psx = 2 * focal * math.tan(0.5 * angle) / width
     psy = 2 * focal * math.tan(0.5 * angle) / aspect / height
 
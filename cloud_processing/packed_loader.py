@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from cloud_processing.annotator import UNLABELED
+from cloud_processing.loader import Loader
+from cloud_processing.plane_cache import PlaneCache
+
+PACKED_MAGIC = b"PLNSEQ01"
+PACKED_VERSION = 1
+# Arrays start at aligned offsets, so their views are aligned as well
+__ALIGNMENT = 64
+
+
+def pack_sequence(loader: Loader, path: str, metadata: Optional[dict] = None) -> int:
+    """
+    Packs back-projected points and labels of all frames into a single file.
+    File starts with magic, length of JSON header and the header with layout
+    of arrays, they follow in the data section at aligned offsets:
+    points of all pixels as float32 of shape (N, 3), compact labels of pixels
+    as uint16 (uint32 for more labels), table of original labels of compact ones
+    and frame offsets into pixels of shape (F + 1,)
+    :param loader: Loader of the sequence that reads source files, it must keep
+        invalid pixels, so pixels of all frames are packed
+    :param path: Path of the packed file
+    :param metadata: Camera intrinsics and other config stored with the sequence
+    :return: Number of packed frames
+    """
+    if loader.drop_invalid:
+        raise ValueError("Loader for packing must keep invalid pixels")
+    frames_count = loader.get_frames_count()
+    frame_sizes = []
+    frame_labels = []
+    for frame_num in range(frames_count):
+        labels = loader.load_frame_labels(frame_num)
+        frame_sizes.append(len(labels))
+        frame_labels.append(np.unique(labels))
+    unique_labels = np.unique(
+        np.concatenate(frame_labels or [np.empty(0, dtype=np.uint32)])
+    )
+    unique_labels = unique_labels[unique_labels != UNLABELED]
+    # Compact label after the plane labels is kept for unlabeled pixels
+    label_table = np.append(unique_labels, UNLABELED).astype(np.uint32)
+    label_dtype = np.uint16 if len(label_table) <= 2**16 else np.uint32
+    frame_offsets = np.concatenate([[0], np.cumsum(frame_sizes, dtype=np.int64)])
+
+    arrays = {
+        "points": (np.dtype(np.float32), (int(frame_offsets[-1]), 3)),
+        "labels": (np.dtype(label_dtype), (int(frame_offsets[-1]),)),
+        "label_table": (np.dtype(np.uint32), label_table.shape),
+        "frame_offsets": (np.dtype(np.int64), frame_offsets.shape),
+    }
+    header = {
+        "version": PACKED_VERSION,
+        "frames_count": frames_count,
+        "metadata": metadata or {},
+        "arrays": {},
+    }
+    data_size = 0
+    for name, (dtype, shape) in arrays.items():
+        header["arrays"][name] = {
+            "offset": data_size,
+            "dtype": dtype.str,
+            "shape": list(shape),
+        }
+        data_size = __align(data_size + dtype.itemsize * int(np.prod(shape)))
+    header_bytes = json.dumps(header).encode()
+    data_start = __align(len(PACKED_MAGIC) + 8 + len(header_bytes))
+
+    # Written through temporary file, so readers never map partial files
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(PACKED_MAGIC)
+        file.write(len(header_bytes).to_bytes(8, "little"))
+        file.write(header_bytes)
+        file.truncate(data_start + data_size)
+    _, views = map_packed_sequence(temp_path, "r+")
+    views["label_table"][:] = label_table
+    views["frame_offsets"][:] = frame_offsets
+    for frame_num in range(frames_count):
+        start, end = frame_offsets[frame_num], frame_offsets[frame_num + 1]
+        points, _ = loader.load_points(frame_num)
+        labels = loader.load_frame_labels(frame_num)
+        views["points"][start:end] = points
+        views["labels"][start:end] = np.searchsorted(label_table[:-1], labels)
+    for view in views.values():
+        view.flush()
+    del views
+    os.replace(temp_path, path)
+    return frames_count
+
+
+def map_packed_sequence(path: str, mode: str = "r") -> Tuple[dict, dict]:
+    """
+    Maps arrays of file written by pack_sequence
+    :param path: Path to the packed file
+    :param mode: Mode of np.memmap
+    :return: Header and memory-mapped arrays by name
+    """
+    with open(path, "rb") as file:
+        if file.read(len(PACKED_MAGIC)) != PACKED_MAGIC:
+            raise ValueError(f"{path} is not a packed sequence")
+        header_length = int.from_bytes(file.read(8), "little")
+        header = json.loads(file.read(header_length))
+    if header["version"] != PACKED_VERSION:
+        raise ValueError(f"Unsupported version of packed sequence {header['version']}")
+
+    data_start = __align(len(PACKED_MAGIC) + 8 + header_length)
+    arrays = {
+        name: np.memmap(
+            path,
+            dtype=np.dtype(layout["dtype"]),
+            mode=mode,
+            offset=data_start + layout["offset"],
+            shape=tuple(layout["shape"]),
+        )
+        for name, layout in header["arrays"].items()
+    }
+    return header, arrays
+
+
+class PackedLoader(Loader):
+    has_depth = False
+
+    def __init__(
+        self,
+        path: str,
+        voxel_size: float = 0,
+        sample_rate: int = 1,
+        with_bitmask: bool = False,
+        cache_memory_limit: int = 2**30,
+        cache_dir: Optional[str] = None,
+        drop_invalid: bool = False,
+        dtype: type = np.float32,
+    ):
+        """
+        Loader of a sequence packed by pack_sequence.
+        The file is memory-mapped, so frames are read-only views of the page cache,
+        nothing is decoded on startup and worker processes share the mapped pages
+        :param path: Path to the packed file
+        :param voxel_size: Size of voxel for down sample
+        :param sample_rate: Rate for down sample
+        :param with_bitmask: Pack plane membership into bitmasks for popcount IoU
+        :param cache_memory_limit: Memory limit for cached planes in bytes, 0 disables it
+        :param cache_dir: Directory for persistent planes cache
+        :param drop_invalid: Drop pixels without depth before processing
+        :param dtype: Type of points and plane geometry, points are stored
+            in float32, so other types copy them
+        """
+        self.path = path
+        self.depth_format = "packed"
+        self.voxel_size = voxel_size
+        self.sample_rate = sample_rate
+        self.with_bitmask = with_bitmask
+        self.cache = PlaneCache(cache_memory_limit, cache_dir)
+        self.drop_invalid = drop_invalid
+        self.dtype = dtype
+        self.__map()
+
+    def __map(self):
+        self.header, arrays = map_packed_sequence(self.path)
+        self.metadata = self.header["metadata"]
+        self.arrays = {name: np.asarray(array) for name, array in arrays.items()}
+
+    def __getstate__(self):
+        # Processes map the file again instead of copying its data
+        state = self.__dict__.copy()
+        del state["arrays"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__map()
+
+    def get_frames_count(self) -> int:
+        return self.header["frames_count"]
+
+    def get_source_paths(self, frame_num: int) -> List[str]:
+        return [self.path]
+
+    def load_points(self, frame_num: int) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        :param frame_num: index of frame in sequence
+        :return: Read-only view of points of the frame and pixel index
+            of each point if invalid pixels are dropped
+        """
+        start, end = self.__get_frame_range(frame_num)
+        points = self.arrays["points"][start:end].astype(self.dtype, copy=False)
+        if not self.drop_invalid:
+            return points, None
+        pixel_indices = np.flatnonzero(
+            np.isfinite(points).all(axis=1) & points.any(axis=1)
+        )
+        return points[pixel_indices], pixel_indices
+
+    def load_frame_labels(
+        self, frame_num: int, pixel_indices: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        start, end = self.__get_frame_range(frame_num)
+        label_ids = self.arrays["labels"][start:end]
+        if pixel_indices is not None:
+            label_ids = label_ids[pixel_indices]
+        return self.arrays["label_table"][label_ids]
+
+    def __get_frame_range(self, frame_num: int) -> Tuple[int, int]:
+        frame_offsets = self.arrays["frame_offsets"]
+        return int(frame_offsets[frame_num]), int(frame_offsets[frame_num + 1])
+
+
+def __align(offset: int) -> int:
+    return -(-offset // __ALIGNMENT) * __ALIGNMENT
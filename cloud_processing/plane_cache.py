@@ -0,0 +1,188 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from dto.bitmask import Bitmask
+from dto.plane_set import PlaneSet
+
+CacheKey = Tuple[int, float, int, str, bool]
+
+__PLANE_SET_FIELDS = [
+    "points",
+    "indices",
+    "offsets",
+    "equations",
+    "colors",
+    "labels",
+    "point_offsets",
+]
+
+
+class PlaneCache:
+    def __init__(self, memory_limit: int, cache_dir: Optional[str] = None):
+        """
+        Cache of extracted planes keyed by (frame index, voxel_size, sample_rate,
+        name of points type, drop_invalid).
+        Keeps least recently used frames in memory and optionally stores
+        all frames in compressed files, so reruns skip preprocessing.
+        Files are named by source files of the frame and store their
+        modification times, so sequences can share the directory and
+        changed sources are extracted again
+        :param memory_limit: Limit of memory for cached planes in bytes, 0 disables it
+        :param cache_dir: Directory for persistent cache
+        """
+        self.memory_limit = memory_limit
+        self.cache_dir = cache_dir
+        self.memory_used = 0
+        self.__frames = OrderedDict()
+        self.__lock = threading.Lock()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __reduce__(self):
+        # Copies for other processes start with empty memory and share only files
+        return PlaneCache, (self.memory_limit, self.cache_dir)
+
+    def get(self, key: CacheKey, sources: Sequence[str] = ()) -> Optional[PlaneSet]:
+        """
+        :param key: Key of the planes
+        :param sources: Paths of files the planes are extracted from
+        :return: Cached planes or None if they are missing or their sources changed
+        """
+        with self.__lock:
+            if key in self.__frames:
+                self.__frames.move_to_end(key)
+                return self.__frames[key][0]
+
+        if self.cache_dir is None:
+            return None
+        path = self.__get_path(key, sources)
+        if not os.path.exists(path):
+            return None
+        planes = load_planes(path, get_source_fingerprint(sources))
+        if planes is not None:
+            self.__put_to_memory(key, planes)
+        return planes
+
+    def put(self, key: CacheKey, planes: PlaneSet, sources: Sequence[str] = ()):
+        self.__put_to_memory(key, planes)
+        if self.cache_dir is not None:
+            save_planes(
+                self.__get_path(key, sources), planes, get_source_fingerprint(sources)
+            )
+
+    def clear(self):
+        with self.__lock:
+            for planes, _ in self.__frames.values():
+                planes.resize_listeners.remove(self.__resize)
+            self.__frames.clear()
+            self.memory_used = 0
+
+    def __put_to_memory(self, key: CacheKey, planes: PlaneSet):
+        nbytes = planes.nbytes
+        if nbytes > self.memory_limit:
+            return
+        with self.__lock:
+            if key in self.__frames:
+                self.__pop(key)
+            self.__frames[key] = (planes, nbytes)
+            self.memory_used += nbytes
+            # Point labels and sketches are built on cached planes later,
+            # their size is counted when the planes report it
+            planes.resize_listeners.append(self.__resize)
+            self.__evict()
+
+    def __resize(self, planes: PlaneSet):
+        nbytes = planes.nbytes
+        with self.__lock:
+            keys = [
+                key
+                for key, (frame_planes, _) in self.__frames.items()
+                if frame_planes is planes
+            ]
+            for key in keys:
+                self.memory_used += nbytes - self.__frames[key][1]
+                self.__frames[key] = (planes, nbytes)
+                if nbytes > self.memory_limit:
+                    self.__pop(key)
+            self.__evict()
+
+    def __evict(self):
+        while self.memory_used > self.memory_limit:
+            self.__pop(next(iter(self.__frames)))
+
+    def __pop(self, key: CacheKey):
+        planes, nbytes = self.__frames.pop(key)
+        planes.resize_listeners.remove(self.__resize)
+        self.memory_used -= nbytes
+
+    def __get_path(self, key: CacheKey, sources: Sequence[str]) -> str:
+        frame_num, voxel_size, sample_rate, dtype_name, drop_invalid = key
+        source_digest = hashlib.sha1(
+            "\n".join(os.path.abspath(path) for path in sources).encode()
+        ).hexdigest()[:16]
+        return os.path.join(
+            self.cache_dir,
+            f"frame{frame_num}_v{voxel_size}_u{sample_rate}"
+            f"_{dtype_name}_d{int(drop_invalid)}_s{source_digest}.npz",
+        )
+
+
+def get_source_fingerprint(sources: Sequence[str]) -> str:
+    """
+    :param sources: Paths of source files
+    :return: Paths of the files with their modification times and sizes
+    """
+    fingerprint = []
+    for path in sources:
+        stat = os.stat(path)
+        fingerprint.append(f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "\n".join(fingerprint)
+
+
+def save_planes(path: str, planes: PlaneSet, source_fingerprint: str = ""):
+    arrays = {field: getattr(planes, field) for field in __PLANE_SET_FIELDS}
+    arrays["source_fingerprint"] = np.array(source_fingerprint)
+    if planes.bitmasks is not None:
+        arrays["bitmask_words"] = np.concatenate(
+            [bitmask.words for bitmask in planes.bitmasks]
+            or [np.empty(0, dtype=np.uint64)]
+        )
+        arrays["bitmask_lengths"] = [len(bitmask.words) for bitmask in planes.bitmasks]
+        arrays["bitmask_starts"] = [bitmask.start for bitmask in planes.bitmasks]
+        arrays["bitmask_counts"] = [bitmask.count for bitmask in planes.bitmasks]
+    # Written through temporary file, so concurrent processes never read partial files
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    np.savez_compressed(temp_path, **arrays)
+    os.replace(temp_path, path)
+
+
+def load_planes(path: str, source_fingerprint: str = "") -> Optional[PlaneSet]:
+    """
+    :param path: Path of file written by save_planes
+    :param source_fingerprint: Fingerprint of the sources the planes are expected from
+    :return: Planes or None if they were saved from other sources
+    """
+    with np.load(path) as data:
+        if (
+            "source_fingerprint" not in data
+            or str(data["source_fingerprint"]) != source_fingerprint
+        ):
+            return None
+        planes = PlaneSet(*[data[field] for field in __PLANE_SET_FIELDS])
+        if "bitmask_words" in data:
+            words = np.split(
+                data["bitmask_words"], np.cumsum(data["bitmask_lengths"])[:-1]
+            )
+            planes.bitmasks = [
+                Bitmask(plane_words, int(start), int(count))
+                for plane_words, start, count in zip(
+                    words, data["bitmask_starts"], data["bitmask_counts"]
+                )
+            ]
+    return planes
@@ -0,0 +1,242 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from cloud_processing.annotator import UNLABELED
+from cloud_processing.loader import Loader
+from cloud_processing.loaders.depth_projector import DepthProjector, get_depth_projector
+from cloud_processing.plane_cache import PlaneCache
+from tracing import TRACER
+
+
+class SyntheticLoader(Loader):
+    # Size of the lookup table of planes over viewing directions
+    TABLE_SIZE = 1024
+    # Number of frames whose labels are kept after rendering, so frames
+    # in flight between depth and labels aren't rendered twice
+    RENDERED_LABELS = 8
+
+    def __init__(
+        self,
+        planes_count: int = 20,
+        width: int = 640,
+        height: int = 480,
+        frames_count: int = 100,
+        depth_noise: float = 0.0,
+        max_rotation: float = 0.1,
+        max_translation: float = 0.1,
+        motion_period: int = 100,
+        seed: int = 0,
+        max_depth: float = 10.0,
+        voxel_size: float = 0,
+        sample_rate: int = 1,
+        with_bitmask: bool = False,
+        cache_memory_limit: int = 2**30,
+        drop_invalid: bool = False,
+        dtype: type = np.float64,
+    ):
+        """
+        Loader of a generated scene, so scaling can be measured without datasets.
+        Planes are fixed in the world and split the field of view into cells
+        of viewing directions, so almost all of them are visible in every frame.
+        The camera sways around the origin. Labels of planes are their indices,
+        so they are the ground truth correspondences between frames.
+        The scene and all frames are determined by the seed
+        :param planes_count: Number of planes in the scene
+        :param width: Width of depth images
+        :param height: Height of depth images
+        :param frames_count: Number of frames in the sequence
+        :param depth_noise: Standard deviation of Gaussian depth noise in meters
+        :param max_rotation: Amplitude of rotation of the camera in radians
+        :param max_translation: Amplitude of translation of the camera in meters
+        :param motion_period: Period of the camera motion in frames
+        :param seed: Seed of the scene, camera motion and noise
+        :param max_depth: Pixels with farther or no intersection have zero depth
+        :param voxel_size: Size of voxel for down sample
+        :param sample_rate: Rate for down sample
+        :param with_bitmask: Pack plane membership into bitmasks for popcount IoU
+        :param cache_memory_limit: Memory limit for cached planes in bytes, 0 disables it
+        :param drop_invalid: Drop pixels without depth before processing
+        :param dtype: Type of points and plane geometry, frames are rendered
+            in float64 for any type
+        """
+        self.planes_count = planes_count
+        self.width = width
+        self.height = height
+        self.frames_count = frames_count
+        self.depth_noise = depth_noise
+        self.max_rotation = max_rotation
+        self.max_translation = max_translation
+        self.motion_period = motion_period
+        self.seed = seed
+        self.max_depth = max_depth
+        self.voxel_size = voxel_size
+        self.sample_rate = sample_rate
+        self.with_bitmask = with_bitmask
+        self.cache = PlaneCache(cache_memory_limit)
+        self.drop_invalid = drop_invalid
+        self.dtype = dtype
+        self.focal_length = 0.8 * width
+        # Tangents of half of the field of view extended by the camera rotation
+        self.extent = np.asarray([width / 2, height / 2]) / self.focal_length
+        self.extent += np.tan(max_rotation)
+
+        rng = np.random.default_rng(seed)
+        # Plane k faces the camera from direction sites[k] at distance
+        # from 1.5 to 5 meters and is tilted by up to 30 degrees
+        sites = np.ones((planes_count, 3))
+        sites[:, :2] = rng.uniform(-self.extent, self.extent, (planes_count, 2))
+        self.sites = self.__get_unit_vectors(sites)
+        distances = rng.uniform(1.5, 5, planes_count)
+        tilts = rng.normal(size=(planes_count, 3)) * np.tan(np.pi / 6) / np.sqrt(3)
+        self.normals = self.__get_unit_vectors(-self.sites + tilts)
+        self.offsets = -np.einsum(
+            "ij,ij->i", self.normals, self.sites * distances[:, np.newaxis]
+        )
+        self.rotation_axis = self.__get_unit_vectors(rng.normal(size=(1, 3)))[0]
+        self.translation_direction = self.__get_unit_vectors(rng.normal(size=(1, 3)))[0]
+        self.directions_table = self.__get_directions_table()
+        self.__init_rendered()
+
+    def __init_rendered(self):
+        self.__rendered_labels = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __getstate__(self):
+        # Processes render their own frames
+        state = self.__dict__.copy()
+        del state["_SyntheticLoader__rendered_labels"]
+        del state["_SyntheticLoader__lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__init_rendered()
+
+    def get_frames_count(self) -> int:
+        return self.frames_count
+
+    def get_source_paths(self, frame_num: int) -> List[str]:
+        # Frames are generated, planes are kept in memory only
+        return []
+
+    def get_pose(self, frame_num: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: Rotation matrix and position of the camera in the world
+        """
+        phase = np.sin(2 * np.pi * frame_num / self.motion_period)
+        angle = self.max_rotation * phase
+        axis = self.rotation_axis
+        cross = np.asarray(
+            [[0, -axis[2], axis[1]], [axis[2], 0, -axis[0]], [-axis[1], axis[0], 0]]
+        )
+        rotation = (
+            np.eye(3) + np.sin(angle) * cross + (1 - np.cos(angle)) * cross @ cross
+        )
+        position = self.max_translation * phase * self.translation_direction
+        return rotation, position
+
+    def generate_frame(self, frame_num: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Renders depth image and label map of the frame, labels are kept
+        for load_frame_labels of the last rendered frames
+        :param frame_num: index of frame in sequence
+        :return: Depth in meters and plane labels of shape (height, width),
+            pixels without depth are UNLABELED
+        """
+        with TRACER.span("generate", frame=frame_num, pixels=self.width * self.height):
+            depth, labels = self.__render(frame_num)
+        labels.flags.writeable = False
+        with self.__lock:
+            self.__rendered_labels[frame_num] = labels
+            self.__rendered_labels.move_to_end(frame_num)
+            while len(self.__rendered_labels) > self.RENDERED_LABELS:
+                self.__rendered_labels.popitem(last=False)
+        return depth, labels
+
+    def __render(self, frame_num: int) -> Tuple[np.ndarray, np.ndarray]:
+        rotation, position = self.get_pose(frame_num)
+        directions = self.__get_projector().rays @ rotation.T
+        labels = self.__get_labels(directions)
+
+        normals = self.normals[labels]
+        offsets = self.offsets[labels] + normals @ position
+        with np.errstate(divide="ignore", invalid="ignore"):
+            depth = -offsets / np.einsum("ij,ij->i", normals, directions)
+        if self.depth_noise != 0:
+            rng = np.random.default_rng((self.seed, frame_num))
+            depth += rng.normal(scale=self.depth_noise, size=len(depth))
+
+        is_valid = np.isfinite(depth) & (depth > 0) & (depth < self.max_depth)
+        depth[~is_valid] = 0
+        labels = labels.astype(np.uint32)
+        labels[~is_valid] = UNLABELED
+        shape = (self.height, self.width)
+        return depth.reshape(shape), labels.reshape(shape)
+
+    def read_depth(self, frame_num: int) -> Tuple[np.ndarray, DepthProjector]:
+        depth, _ = self.generate_frame(frame_num)
+        return depth, self.__get_projector(self.dtype)
+
+    def load_frame_labels(
+        self, frame_num: int, pixel_indices: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Labels are taken from the render of the depth if it is recent,
+        the frame is rendered otherwise
+        :param frame_num: index of frame in sequence
+        :param pixel_indices: Pixel index of each point, points are pixels by default
+        :return: Label of each point
+        """
+        with self.__lock:
+            labels = self.__rendered_labels.get(frame_num)
+        if labels is None:
+            _, labels = self.generate_frame(frame_num)
+        labels = labels.reshape(-1)
+        if pixel_indices is not None:
+            labels = labels[pixel_indices]
+        return labels
+
+    def __get_projector(self, dtype: type = np.float64):
+        return get_depth_projector(
+            self.width,
+            self.height,
+            self.focal_length,
+            self.focal_length,
+            (self.width - 1) / 2,
+            (self.height - 1) / 2,
+            1,
+            dtype=dtype,
+        )
+
+    def __get_directions_table(self) -> np.ndarray:
+        # Nearest site of each cell of grid over tangents of viewing directions,
+        # rows are computed in chunks to bound memory for many planes
+        steps = (np.arange(self.TABLE_SIZE) + 0.5) / self.TABLE_SIZE * 2 - 1
+        table = np.empty((self.TABLE_SIZE, self.TABLE_SIZE), dtype=int)
+        for row in range(0, self.TABLE_SIZE, 64):
+            tangents_y, tangents_x = np.meshgrid(
+                steps[row : row + 64] * self.extent[1],
+                steps * self.extent[0],
+                indexing="ij",
+            )
+            directions = np.stack(
+                [tangents_x, tangents_y, np.ones_like(tangents_x)], axis=-1
+            ).reshape((-1, 3))
+            table[row : row + 64] = np.argmax(
+                directions @ self.sites.T, axis=1
+            ).reshape((-1, self.TABLE_SIZE))
+        return table
+
+    def __get_labels(self, directions: np.ndarray) -> np.ndarray:
+        # Directions outside of the grid take the nearest cell at its border
+        tangents = directions[:, :2] / directions[:, 2:]
+        cells = ((tangents / self.extent + 1) / 2 * self.TABLE_SIZE).astype(int)
+        np.clip(cells, 0, self.TABLE_SIZE - 1, out=cells)
+        return self.directions_table[cells[:, 1], cells[:, 0]]
+
+    @staticmethod
+    def __get_unit_vectors(vectors: np.ndarray) -> np.ndarray:
+        return vectors / np.linalg.norm(vectors, axis=1)[:, np.newaxis]
@@ -0,0 +1,22 @@
+import argparse
+import configparser
+
+from cloud_processing.loaders.icl_raw_loader import convert_icl_raw_sequence
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Converts ICL NUIM raw depth into binary arrays read by Loader"
+    )
+    parser.add_argument("path_to_depth")
+    parser.add_argument("config_path")
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read(args.config_path)
+
+    intrinsics_config = config["INTRINSICS"]
+    frames_count = convert_icl_raw_sequence(
+        args.path_to_depth,
+        int(intrinsics_config["width"]),
+        int(intrinsics_config["height"]),
+    )
+    print(f"Converted {frames_count} frames")
@@ -0,0 +1,53 @@
+import numpy as np
+
+WORD_BITS = 64
+
+_POPCOUNT_TABLE = np.array([bin(byte).count("1") for byte in range(256)], np.uint8)
+
+
+def popcount(words: np.ndarray) -> int:
+    """
+    Counts set bits in array of uint64 words
+    """
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(words).sum())
+    return int(_POPCOUNT_TABLE[words.view(np.uint8)].sum(dtype=np.int64))
+
+
+class Bitmask:
+    def __init__(self, words: np.ndarray, start: int, count: int):
+        """
+        Packed membership of points in the frame grid.
+        Only the span of words between the first and the last set bit is stored.
+        :param words: Packed bits as uint64 words
+        :param start: Index of the first stored word in the frame grid
+        :param count: Number of set bits
+        """
+        self.words = words
+        self.start = start
+        self.count = count
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.words)
+
+    @staticmethod
+    def from_indices(indices: np.ndarray) -> "Bitmask":
+        if len(indices) == 0:
+            return Bitmask(np.empty(0, dtype=np.uint64), 0, 0)
+        start = int(indices.min()) // WORD_BITS
+        end = int(indices.max()) // WORD_BITS + 1
+        bits = np.zeros((end - start) * WORD_BITS, dtype=bool)
+        bits[indices - start * WORD_BITS] = True
+        words = np.packbits(bits, bitorder="little").view(np.uint64)
+        return Bitmask(words, start, int(bits.sum()))
+
+    def intersection_count(self, other: "Bitmask") -> int:
+        start = max(self.start, other.start)
+        end = min(self.end, other.end)
+        if start >= end:
+            return 0
+        return popcount(
+            self.words[start - self.start : end - self.start]
+            & other.words[start - other.start : end - other.start]
+        )
@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+
+# Pads sketches of planes with fewer points than the sketch size
+EMPTY_HASH = np.iinfo(np.uint64).max
+
+
+def get_sketch_size(error: float) -> int:
+    """
+    Size of bottom-k sketch for the error bound,
+    standard deviation of the estimate is at most 1 / (2 * sqrt(size))
+    :param error: Bound of standard deviation of estimated Jaccard index
+    """
+    return math.ceil(1 / (4 * error**2))
+
+
+def hash_indices(indices: np.ndarray) -> np.ndarray:
+    """
+    Mixes point indices into uniformly distributed 64-bit hashes (splitmix64)
+    """
+    hashes = indices.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def build_sketches(
+    indices: np.ndarray, offsets: np.ndarray, sketch_size: int
+) -> np.ndarray:
+    """
+    Builds bottom-k sketches: the smallest hashes of points of each plane.
+    Sketch of plane with fewer points keeps all of them, so its estimates are exact
+    :param indices: Point cloud indices of all planes grouped by plane
+    :param offsets: Start of each plane in indices, shape (P + 1,)
+    :param sketch_size: Number of hashes in sketch
+    :return: Sorted hashes of shape (P, sketch_size) padded with EMPTY_HASH
+    """
+    hashes = hash_indices(indices)
+    sketches = np.full((len(offsets) - 1, sketch_size), EMPTY_HASH, dtype=np.uint64)
+    for plane_index, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        plane_hashes = hashes[start:end]
+        if len(plane_hashes) > sketch_size:
+            plane_hashes = np.partition(plane_hashes, sketch_size - 1)[:sketch_size]
+        sketches[plane_index, : len(plane_hashes)] = np.sort(plane_hashes)
+    return sketches
+
+
+def estimate_jaccard_matrix(sketches1: np.ndarray, sketches2: np.ndarray) -> np.ndarray:
+    """
+    Estimates Jaccard indices for all pairs of sketched planes.
+    Both sketches hold all hashes of their planes up to the smaller of their
+    largest hashes, the estimate is the fraction of these hashes of the union
+    that are present in both planes
+    :param sketches1: Sketches of the first frame, shape (P, K)
+    :param sketches2: Sketches of the second frame, shape (Q, K)
+    :return: Matrix of shape (P, Q)
+    """
+    shape = (len(sketches1), len(sketches2))
+    sketch_size = sketches1.shape[1]
+    thresholds = np.minimum(sketches1[:, -1, np.newaxis], sketches2[np.newaxis, :, -1])
+    below1 = __count_below(sketches1, thresholds)
+    below2 = __count_below(sketches2, thresholds.T).T
+
+    # Shared hashes of all pairs are found with one join of both frames
+    hashes1 = sketches1.reshape(-1)
+    planes1 = np.repeat(np.arange(shape[0]), sketch_size)
+    is_filled1 = hashes1 != EMPTY_HASH
+    hashes1 = hashes1[is_filled1]
+    planes1 = planes1[is_filled1]
+    order2 = np.argsort(sketches2, axis=None, kind="stable")
+    hashes2 = sketches2.reshape(-1)[order2]
+    starts = np.searchsorted(hashes2, hashes1, side="left")
+    counts = np.searchsorted(hashes2, hashes1, side="right") - starts
+    join_offsets = np.cumsum(counts) - counts
+    positions = np.arange(counts.sum()) + np.repeat(starts - join_offsets, counts)
+
+    rows = np.repeat(planes1, counts)
+    cols = order2[positions] // sketch_size
+    is_shared = np.repeat(hashes1, counts) <= thresholds[rows, cols]
+    shared = np.bincount(
+        rows[is_shared] * shape[1] + cols[is_shared], minlength=shape[0] * shape[1]
+    ).reshape(shape)
+
+    union = below1 + below2 - shared
+    return np.divide(shared, union, out=np.zeros(shape), where=union != 0)
+
+
+def __count_below(sketches: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    filled = np.count_nonzero(sketches != EMPTY_HASH, axis=1)
+    below = np.asarray(
+        [
+            np.searchsorted(sketch, sketch_thresholds, side="right")
+            for sketch, sketch_thresholds in zip(sketches, thresholds)
+        ]
+    ).reshape(thresholds.shape)
+    return np.minimum(below, filled[:, np.newaxis])
@@ -1,22 +1,63 @@
 import numpy as np
 
+from tracing import TRACER
+
 
 class Plane:
-    def __init__(self, points, pcd_indices, equation, color):
+    # Upper triangle of the symmetric scatter matrix and its row-major layout
+    __SCATTER_PAIRS = [(0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)]
+    __SCATTER_INDICES = [0, 1, 2, 1, 3, 4, 2, 4, 5]
+
+    def __init__(self, points, pcd_indices, equation, color, bitmask=None, label=None):
         self.points = points
         self.pcd_indices = pcd_indices
         self.equation = equation
         self.color = color
+        self.bitmask = bitmask
+        self.label = label
 
     @staticmethod
     def get_normal(points):
-        c = np.mean(points, axis=0)
-        A = np.array(points) - c
-        eigvals, eigvects = np.linalg.eig(A.T @ A)
-        min_index = np.argmin(eigvals)
-        n = eigvects[:, min_index]
-
-        d = -np.dot(n, c)
-        normal = int(np.sign(d)) * n
-        d *= np.sign(d)
-        return np.asarray([normal[0], normal[1], normal[2], d])
+        return Plane.get_normals(points, np.asarray([0, len(points)]))[0]
+
+    @staticmethod
+    def get_normals(points, offsets, dtype=np.float64):
+        """
+        Fits all planes at once, points of plane i are
+        points[offsets[i]:offsets[i + 1]]
+        :param points: Points of all planes grouped by plane, shape (N, 3)
+        :param offsets: Start of each plane in points, shape (P + 1,)
+        :param dtype: Type of the fitting, float32 is faster but less precise
+        :return: Plane equations of shape (P, 4),
+            normals are oriented so that the last coefficient is non-negative
+        """
+        with TRACER.span("get_normals", points=len(points), planes=len(offsets) - 1):
+            return Plane.__fit_planes(points, offsets, dtype)
+
+    @staticmethod
+    def __fit_planes(points, offsets, dtype):
+        planes_count = len(offsets) - 1
+        sizes = np.diff(offsets)
+        is_filled = sizes != 0
+        starts = offsets[:-1][is_filled]
+        # Coordinate-major copy makes every segment sum contiguous
+        A = np.array(np.asarray(points).T, dtype=dtype, order="C")
+
+        centroids = np.zeros((3, planes_count), dtype=dtype)
+        centroids[:, is_filled] = np.add.reduceat(A, starts, axis=1) / sizes[is_filled]
+        A -= np.repeat(centroids, sizes, axis=1)
+
+        products = np.empty((len(Plane.__SCATTER_PAIRS), A.shape[1]), dtype=dtype)
+        for k, (i, j) in enumerate(Plane.__SCATTER_PAIRS):
+            np.multiply(A[i], A[j], out=products[k])
+        scatters = np.zeros((len(Plane.__SCATTER_PAIRS), planes_count), dtype=dtype)
+        scatters[:, is_filled] = np.add.reduceat(products, starts, axis=1)
+        scatters = scatters[Plane.__SCATTER_INDICES].T.reshape((-1, 3, 3))
+
+        # Eigenvalues are ascending, the first eigenvector is the normal
+        _, eigvects = np.linalg.eigh(scatters)
+        n = eigvects[:, :, 0]
+
+        d = -np.einsum("ij,ji->i", n, centroids)
+        signs = np.sign(d)
+        return np.column_stack([n * signs[:, np.newaxis], d * signs])
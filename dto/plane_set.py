@@ -0,0 +1,202 @@
+from collections.abc import Sequence
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from dto.bitmask import Bitmask
+from dto.minhash import build_sketches
+from dto.plane import Plane
+
+
+class PlaneSet(Sequence):
+    def __init__(
+        self,
+        points: np.ndarray,
+        indices: np.ndarray,
+        offsets: np.ndarray,
+        equations: np.ndarray,
+        colors: np.ndarray,
+        labels: np.ndarray,
+        point_offsets: Optional[np.ndarray] = None,
+        bitmasks: Optional[List[Bitmask]] = None,
+    ):
+        """
+        All planes of one frame stored as contiguous arrays.
+        Point cloud indices and points of plane i are
+        indices[offsets[i]:offsets[i + 1]] and
+        points[point_offsets[i]:point_offsets[i + 1]]
+        :param points: Points of all planes grouped by plane, shape (M, 3)
+        :param indices: Point cloud indices of all planes grouped by plane, shape (K,)
+        :param offsets: Start of each plane in indices, shape (P + 1,)
+        :param equations: Plane equations, shape (P, 4)
+        :param colors: Plane colors, shape (P, 3)
+        :param labels: Plane labels that are the same in all frames, shape (P,)
+        :param point_offsets: Start of each plane in points, offsets by default
+        :param bitmasks: Packed membership of each plane
+        """
+        self.points = points
+        self.indices = indices
+        self.offsets = offsets
+        self.equations = equations
+        self.colors = colors
+        self.labels = labels
+        self.point_offsets = offsets if point_offsets is None else point_offsets
+        self.bitmasks = bitmasks
+        self.__planes = None
+        self.__point_labels = None
+        self.__is_labeled = False
+        self.__sketches = {}
+        # Called with the set after derived arrays change its nbytes,
+        # so caches holding the frame keep their accounting exact
+        self.resize_listeners: List[Callable[["PlaneSet"], None]] = []
+
+    def __getstate__(self):
+        # Listeners belong to caches of this process
+        state = self.__dict__.copy()
+        state["resize_listeners"] = []
+        return state
+
+    @staticmethod
+    def from_planes(planes: List[Plane]) -> "PlaneSet":
+        sizes = [len(plane.pcd_indices) for plane in planes]
+        point_sizes = [len(plane.points) for plane in planes]
+        has_bitmasks = len(planes) != 0 and all(
+            plane.bitmask is not None for plane in planes
+        )
+        # Geometry and colors keep the type of equations, as get_equations does
+        equations = np.asarray([plane.equation for plane in planes]).reshape((-1, 4))
+        return PlaneSet(
+            np.concatenate(
+                [plane.points for plane in planes]
+                or [np.empty((0, 3), dtype=equations.dtype)]
+            ),
+            np.concatenate(
+                [plane.pcd_indices for plane in planes] or [np.empty(0, dtype=int)]
+            ),
+            np.concatenate([[0], np.cumsum(sizes, dtype=int)]),
+            equations,
+            np.asarray(
+                [plane.color for plane in planes], dtype=equations.dtype
+            ).reshape((-1, 3)),
+            np.asarray(
+                [plane.label for plane in planes]
+                if all(plane.label is not None for plane in planes)
+                else np.arange(len(planes))
+            ),
+            np.concatenate([[0], np.cumsum(point_sizes, dtype=int)]),
+            [plane.bitmask for plane in planes] if has_bitmasks else None,
+        )
+
+    def without_derived(self) -> "PlaneSet":
+        """
+        Set sharing arrays and bitmasks of the planes without point labels
+        and sketches built on them, so building them can be timed again
+        """
+        return PlaneSet(
+            self.points,
+            self.indices,
+            self.offsets,
+            self.equations,
+            self.colors,
+            self.labels,
+            self.point_offsets,
+            self.bitmasks,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.points, self.indices, self.offsets, self.point_offsets]
+        arrays += [self.equations, self.colors, self.labels]
+        if self.bitmasks is not None:
+            arrays += [bitmask.words for bitmask in self.bitmasks]
+        if self.__point_labels is not None:
+            arrays.append(self.__point_labels)
+        arrays += list(self.__sketches.values())
+        return sum(array.nbytes for array in arrays)
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    @property
+    def index_labels(self) -> np.ndarray:
+        """
+        Index of the plane for each point cloud index in indices
+        """
+        return np.repeat(np.arange(len(self)), self.sizes)
+
+    @property
+    def point_labels(self) -> Optional[np.ndarray]:
+        """
+        Index of the plane for each point cloud index up to the largest one,
+        len(self) for points without plane. Built once and kept with the frame
+        in the smallest unsigned type that holds len(self)
+        :return: Labels or None if planes share points
+        """
+        if not self.__is_labeled:
+            labels = np.full(
+                int(self.indices.max(initial=-1)) + 1,
+                len(self),
+                dtype=np.min_scalar_type(len(self)),
+            )
+            labels[self.indices] = self.index_labels
+            is_disjoint = (
+                np.bincount(labels, minlength=len(self) + 1)[:-1] == self.sizes
+            ).all()
+            self.__point_labels = labels if is_disjoint else None
+            self.__is_labeled = True
+            self.__notify_resize()
+        return self.__point_labels
+
+    def get_sketches(self, sketch_size: int) -> np.ndarray:
+        """
+        Bottom-k sketches of planes, built once for each size
+        :param sketch_size: Number of hashes in sketch
+        :return: Sketches of shape (P, sketch_size)
+        """
+        if sketch_size not in self.__sketches:
+            self.__sketches[sketch_size] = build_sketches(
+                self.indices, self.offsets, sketch_size
+            )
+            self.__notify_resize()
+        return self.__sketches[sketch_size]
+
+    def pack_bitmasks(self):
+        """
+        Packs membership of each plane into bitmask
+        """
+        self.bitmasks = [
+            Bitmask.from_indices(self.indices[start:end])
+            for start, end in zip(self.offsets[:-1], self.offsets[1:])
+        ]
+        self.__planes = None
+        self.__notify_resize()
+
+    def __notify_resize(self):
+        for listener in list(self.resize_listeners):
+            listener(self)
+
+    @property
+    def planes(self) -> List[Plane]:
+        """
+        Plane views of the stored arrays, created once so they can be used as keys
+        """
+        if self.__planes is None:
+            self.__planes = [
+                Plane(
+                    self.points[self.point_offsets[i] : self.point_offsets[i + 1]],
+                    self.indices[self.offsets[i] : self.offsets[i + 1]],
+                    self.equations[i],
+                    self.colors[i],
+                    None if self.bitmasks is None else self.bitmasks[i],
+                    self.labels[i],
+                )
+                for i in range(len(self))
+            ]
+        return self.__planes
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.planes[index]
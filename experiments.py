@@ -1,18 +1,42 @@
+import copy
 import csv
+import inspect
+import itertools
+import math
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
 from statistics import mean
-from typing import List, Tuple
+from contextlib import nullcontext
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 
-import time
-
 from association.assoc_methods.assoc_method import AssocMethod
+from association.assoc_methods.jaccard_thresholded import JaccardThresholded
 from association.associator import Associator
+from benchmark import measure
 
 from cloud_processing.loader import Loader
+from dto.plane_set import PlaneSet
+
+STRIDE = 10
+
+__worker_loader: Optional[Loader] = None
+
 
+def quality_test(
+    methods: List[Tuple[AssocMethod, float, int]], loader: Loader, workers: int = 1
+):
+    """
+    Evaluates quality of association for every 10th frames pair.
+    With several workers the frames range is split into chunks that are
+    evaluated in separate processes, results are merged in frames order
+    :param methods: Methods with voxel_size and sample_rate for down sample
+    :param loader: Loader of the sequence
+    :param workers: Number of worker processes
+    """
 
-def quality_test(methods: List[Tuple[AssocMethod, float, int]], loader: Loader):
     def plot_metric_res(
         x, method_res, metric_type: str, method_name: str, min_y: float
     ):
@@ -29,55 +53,22 @@ def quality_test(methods: List[Tuple[AssocMethod, float, int]], loader: Loader):
     algo_point_results = {}
     plane_min_y = 1
     point_min_y = 1
-    x = range(0, loader.get_frames_count() - 1, 10)
-    for method, voxel_size, sample_rate in methods:
-        loader.set_down_sample_params(voxel_size, sample_rate)
-        results_planes = []
-        results_points = []
-        for i in tqdm(x):
-            prev_planes = loader.get_planes_for_frame(i)
-            cur_planes = loader.get_planes_for_frame(i + 1)
-
-            # Plane that doesn't exist on the previous frame must be matched with None
-            non_existing_planes = set()
-            for cur_plane in cur_planes:
-                is_found = False
-                for prev_plane in prev_planes:
-                    if (prev_plane.color == cur_plane.color).all():
-                        is_found = True
-                        break
-                if not is_found:
-                    non_existing_planes.add(cur_plane)
-
-            associator = Associator(cur_planes, prev_planes)
-            associated = associator.associate(method)
-
-            # TODO: use EVOPS
-            right = 0
-            right_points = 0
-            all_points = 0
-            for (cur_plane, prev_plane) in associated.items():
-                all_points += len(cur_plane.points)
-                if prev_plane is not None:
-                    if (prev_plane.color == cur_plane.color).all():
-                        right += 1
-                        right_points += len(cur_plane.points)
-                else:
-                    if cur_plane in non_existing_planes:
-                        right += 1
-                        right_points += len(cur_plane.points)
-
-            results_planes.append(right / len(associated))
-            results_points.append(right_points / all_points)
-
-        algo_plane_results[
-            f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
-        ] = results_planes
-        algo_point_results[
-            f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
-        ] = results_points
-        point_min_y = min(point_min_y, min(results_points))
-        plane_min_y = min(plane_min_y, min(results_planes))
+    x = range(0, loader.get_frames_count() - 1, STRIDE)
+    with create_worker_pool(loader, workers) as executor:
+        for method, voxel_size, sample_rate in methods:
+            loader.set_down_sample_params(voxel_size, sample_rate)
+            results_planes, results_points = __evaluate_quality(
+                method, loader, x, executor, workers
+            )
+
+            algo_plane_results[
+                f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+            ] = results_planes
+            algo_point_results[
+                f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+            ] = results_points
+            point_min_y = min(point_min_y, min(results_points))
+            plane_min_y = min(plane_min_y, min(results_planes))
 
     for algo in algo_plane_results.keys():
         plot_metric_res(x, algo_plane_results[algo], "planes", algo, plane_min_y)
@@ -90,28 +81,360 @@ def quality_test(methods: List[Tuple[AssocMethod, float, int]], loader: Loader):
         dump_res_to_csv(file, x, algo_point_results)
 
 
-def performance_test(methods: List[Tuple[AssocMethod, float, int]], loader: Loader):
-    x = range(0, loader.get_frames_count() - 1, 10)
-    total_results = {}
-    for method, voxel_size, sample_rate in methods:
-        loader.set_down_sample_params(voxel_size, sample_rate)
-        results = []
-        for i in tqdm(x):
-            prev_planes = loader.get_planes_for_frame(i)
-            cur_planes = loader.get_planes_for_frame(i + 1)
-
-            associator = Associator(cur_planes, prev_planes)
-            one_frame_results = []
-            for _ in range(10):
-                start = time.time()
-                associator.associate(method)
-                end = time.time()
-                one_frame_results.append(end - start)
-            results.append(mean(one_frame_results))
-        total_results[f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"] = results
-        plt.plot(
-            x, results, label=f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+def approximation_test(
+    methods: List[Tuple[AssocMethod, float, int]], loader: Loader, workers: int = 1
+):
+    """
+    Compares quality of association with approximate MinHash Jaccard indices
+    against the exact ones for every 10th frames pair
+    :param methods: Methods with voxel_size and sample_rate for down sample
+    :param loader: Loader of the sequence
+    :param workers: Number of worker processes
+    """
+    x = range(0, loader.get_frames_count() - 1, STRIDE)
+    changes = {}
+    with create_worker_pool(loader, workers) as executor:
+        for method, voxel_size, sample_rate in methods:
+            loader.set_down_sample_params(voxel_size, sample_rate)
+            approximate_method = copy.deepcopy(method)
+            approximate_method.jaccard_backend = "minhash"
+            exact_results = __evaluate_quality(method, loader, x, executor, workers)
+            approximate_results = __evaluate_quality(
+                approximate_method, loader, x, executor, workers
+            )
+
+            name = f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+            for metric_type, exact, approximate in zip(
+                ["planes", "points"], exact_results, approximate_results
+            ):
+                changes[f"{name}_{metric_type}"] = [
+                    approximate_result - exact_result
+                    for exact_result, approximate_result in zip(exact, approximate)
+                ]
+                print(
+                    f"{name}: mean {metric_type} score change with MinHash "
+                    f"{mean(changes[f'{name}_{metric_type}']):+.4f}"
+                )
+
+    with open("plane_assoc_minhash.csv", "w", newline="") as file:
+        dump_res_to_csv(file, x, changes)
+
+
+def precision_test(
+    methods: List[Tuple[AssocMethod, float, int]], loader: Loader, workers: int = 1
+):
+    """
+    Compares quality of association with float32 points and plane geometry
+    against float64 for every 10th frames pair
+    :param methods: Methods with voxel_size and sample_rate for down sample
+    :param loader: Loader of the sequence
+    :param workers: Number of worker processes
+    """
+    x = range(0, loader.get_frames_count() - 1, STRIDE)
+    precision_results = []
+    for dtype in [np.float64, np.float32]:
+        # Planes of both types share the cache, they are keyed by type
+        precision_loader = copy.copy(loader)
+        precision_loader.dtype = dtype
+        with create_worker_pool(precision_loader, workers) as executor:
+            dtype_results = []
+            for method, voxel_size, sample_rate in methods:
+                precision_loader.set_down_sample_params(voxel_size, sample_rate)
+                dtype_results.append(
+                    __evaluate_quality(method, precision_loader, x, executor, workers)
+                )
+            precision_results.append(dtype_results)
+
+    changes = {}
+    for (method, voxel_size, sample_rate), exact_results, compact_results in zip(
+        methods, *precision_results
+    ):
+        name = f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+        for metric_type, exact, compact in zip(
+            ["planes", "points"], exact_results, compact_results
+        ):
+            changes[f"{name}_{metric_type}"] = [
+                compact_result - exact_result
+                for exact_result, compact_result in zip(exact, compact)
+            ]
+            print(
+                f"{name}: mean {metric_type} score change with float32 "
+                f"{mean(changes[f'{name}_{metric_type}']):+.4f}"
+            )
+
+    with open("plane_assoc_float32.csv", "w", newline="") as file:
+        dump_res_to_csv(file, x, changes)
+
+
+def sweep_test(
+    methods: List[Tuple[AssocMethod, float, int]],
+    loader: Loader,
+    workers: int = 1,
+    repetitions: int = 10,
+):
+    """
+    Evaluates quality and performance of all methods for every 10th frames pair
+    on shared data: each frame is loaded once, each of its down sample levels
+    is derived once and all methods with this level are evaluated on the same
+    planes, so grids of method parameters cost little more than association.
+    Writes the same CSV files as quality_test and performance_test
+    :param methods: Methods with voxel_size and sample_rate for down sample
+    :param loader: Loader of the sequence
+    :param workers: Number of worker processes for preprocessing
+    :param repetitions: Number of timed runs of association of each pair
+    """
+    x = range(0, loader.get_frames_count() - 1, STRIDE)
+    names = get_method_names(methods)
+    levels = list(dict.fromkeys((voxel, rate) for _, voxel, rate in methods))
+    results_planes = {name: [] for name in names}
+    results_points = {name: [] for name in names}
+    results_times = {name: [] for name in names}
+    for method, _, _ in methods:
+        if isinstance(method, JaccardThresholded):
+            method.reset_prune_counts()
+    with create_worker_pool(loader, workers) as executor:
+        level_pairs = __iter_loaded_level_pairs(
+            loader, x, levels, executor, workers * 4
+        )
+        for prev_levels, cur_levels in tqdm(level_pairs, total=len(x)):
+            for name, (method, voxel_size, sample_rate) in zip(names, methods):
+                prev_planes = prev_levels[(voxel_size, sample_rate)]
+                cur_planes = cur_levels[(voxel_size, sample_rate)]
+                plane_result, point_result = get_pair_quality(
+                    prev_planes, cur_planes, method
+                )
+                results_planes[name].append(plane_result)
+                results_points[name].append(point_result)
+                times, _ = measure(
+                    lambda associator: associator.associate(method),
+                    repetitions,
+                    setup=partial(__get_fresh_associator, prev_planes, cur_planes),
+                )
+                results_times[name].append(mean(times) / 1e9)
+
+    for results, result_type in [
+        (results_planes, "planes"),
+        (results_points, "points"),
+        (results_times, "perf"),
+    ]:
+        for name, name_results in results.items():
+            plt.plot(x, name_results, label=name)
+        plt.xlabel("Position number")
+        plt.title(f"Plane association {result_type}")
+        plt.legend()
+        plt.savefig(f"plane_assoc_sweep_{result_type}.pdf")
+        plt.show()
+        with open(f"plane_assoc_{result_type}.csv", "w", newline="") as file:
+            dump_res_to_csv(file, x, results)
+
+
+def get_method_grid(
+    method_type: type, levels: List[Tuple[float, int]], **parameter_values
+) -> List[Tuple[AssocMethod, float, int]]:
+    """
+    Creates methods for all combinations of parameters and down sample levels
+    :param method_type: Class of the method
+    :param levels: Pairs of voxel_size and sample_rate
+    :param parameter_values: Values of each parameter of the method
+    :return: Methods with voxel_size and sample_rate for sweep_test
+    """
+    parameters = list(parameter_values.keys())
+    return [
+        (method_type(**dict(zip(parameters, values))), voxel_size, sample_rate)
+        for values in itertools.product(*parameter_values.values())
+        for voxel_size, sample_rate in levels
+    ]
+
+
+def get_method_names(methods: List[Tuple[AssocMethod, float, int]]) -> List[str]:
+    """
+    Names methods by type and down sample parameters, methods with the same name
+    are told apart by values of parameters that differ between them
+    """
+    names = [
+        f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+        for method, voxel_size, sample_rate in methods
+    ]
+    for name in set(names):
+        group = [
+            method for (method, _, _), other in zip(methods, names) if other == name
+        ]
+        if len(group) == 1:
+            continue
+        parameters = [
+            parameter
+            for parameter in inspect.signature(type(group[0])).parameters
+            if any(
+                getattr(method, parameter) != getattr(group[0], parameter)
+                for method in group
+            )
+        ]
+        names = [
+            other
+            + "".join(
+                f"_{parameter}{getattr(method, parameter)}" for parameter in parameters
+            )
+            if other == name
+            else other
+            for (method, _, _), other in zip(methods, names)
+        ]
+    return names
+
+
+def __iter_loaded_level_pairs(
+    loader: Loader,
+    frames: range,
+    levels: List[Tuple[float, int]],
+    executor: Optional[Executor],
+    batch_size: int,
+) -> Iterator[Tuple[dict, dict]]:
+    # As in __iter_loaded_pairs, nothing is loading while pairs are processed
+    if executor is None:
+        for frame_num in frames:
+            yield (
+                loader.get_planes_for_levels(frame_num, levels),
+                loader.get_planes_for_levels(frame_num + 1, levels),
+            )
+        return
+    load_pairs = partial(__load_level_pairs, levels)
+    for batch in split_range(frames, batch_size):
+        for pairs in list(executor.map(load_pairs, split_range(batch, 1))):
+            yield from pairs
+
+
+def __load_level_pairs(
+    levels: List[Tuple[float, int]], frames: range
+) -> List[Tuple[dict, dict]]:
+    return [
+        (
+            __worker_loader.get_planes_for_levels(frame_num, levels),
+            __worker_loader.get_planes_for_levels(frame_num + 1, levels),
         )
+        for frame_num in frames
+    ]
+
+
+def __evaluate_quality(
+    method: AssocMethod,
+    loader: Loader,
+    frames: range,
+    executor: Optional[Executor],
+    workers: int,
+) -> Tuple[List[float], List[float]]:
+    results_planes = []
+    results_points = []
+    if executor is None:
+        frame_pairs = loader.iter_frame_pairs(frames.step)
+        for prev_planes, cur_planes in tqdm(frame_pairs, total=len(frames)):
+            plane_result, point_result = get_pair_quality(
+                prev_planes, cur_planes, method
+            )
+            results_planes.append(plane_result)
+            results_points.append(point_result)
+    else:
+        chunk_size = max(1, math.ceil(len(frames) / (workers * 4)))
+        chunks = split_range(frames, chunk_size)
+        evaluate_chunk = partial(
+            __get_chunk_quality, method, loader.voxel_size, loader.sample_rate
+        )
+        for chunk_results in tqdm(
+            executor.map(evaluate_chunk, chunks), total=len(chunks)
+        ):
+            for plane_result, point_result in chunk_results:
+                results_planes.append(plane_result)
+                results_points.append(point_result)
+    return results_planes, results_points
+
+
+def get_pair_quality(
+    prev_planes: PlaneSet, cur_planes: PlaneSet, method: AssocMethod
+) -> Tuple[float, float]:
+    """
+    Evaluates association of frames pair
+    :return: Ratios of correctly associated planes and points
+    """
+    # Plane that doesn't exist on the previous frame must be matched with None
+    prev_labels = {prev_plane.label for prev_plane in prev_planes}
+    non_existing_planes = {
+        cur_plane for cur_plane in cur_planes if cur_plane.label not in prev_labels
+    }
+
+    # Pruned pairs are counted once for each evaluated pair
+    counting = (
+        method.counting_pruned()
+        if isinstance(method, JaccardThresholded)
+        else nullcontext()
+    )
+    associator = Associator(cur_planes, prev_planes)
+    with counting:
+        associated = associator.associate(method)
+
+    # TODO: use EVOPS
+    right = 0
+    right_points = 0
+    all_points = 0
+    for (cur_plane, prev_plane) in associated.items():
+        all_points += len(cur_plane.points)
+        if prev_plane is not None:
+            if prev_plane.label == cur_plane.label:
+                right += 1
+                right_points += len(cur_plane.points)
+        else:
+            if cur_plane in non_existing_planes:
+                right += 1
+                right_points += len(cur_plane.points)
+
+    return right / len(associated), right_points / all_points
+
+
+def __get_chunk_quality(
+    method: AssocMethod, voxel_size: float, sample_rate: int, frames: range
+) -> List[Tuple[float, float]]:
+    __worker_loader.set_down_sample_params(voxel_size, sample_rate)
+    frame_pairs = __worker_loader.iter_frame_pairs(
+        frames.step, prefetch=0, start=frames.start, stop=frames.stop
+    )
+    return [
+        get_pair_quality(prev_planes, cur_planes, method)
+        for prev_planes, cur_planes in frame_pairs
+    ]
+
+
+def performance_test(
+    methods: List[Tuple[AssocMethod, float, int]], loader: Loader, workers: int = 1
+):
+    """
+    Measures mean association time in seconds for every 10th frames pair
+    over 10 runs after a warmup run, stages are timed separately by benchmark.py.
+    With several workers frames are prepared by worker processes in batches,
+    but association is always timed in this process when no batch is loading,
+    so parallel preprocessing doesn't distort the latency
+    :param methods: Methods with voxel_size and sample_rate for down sample
+    :param loader: Loader of the sequence
+    :param workers: Number of worker processes for preprocessing
+    """
+    x = range(0, loader.get_frames_count() - 1, STRIDE)
+    total_results = {}
+    with create_worker_pool(loader, workers) as executor:
+        for method, voxel_size, sample_rate in methods:
+            loader.set_down_sample_params(voxel_size, sample_rate)
+            results = []
+            frame_pairs = __iter_loaded_pairs(loader, x, executor, workers * 4)
+            for prev_planes, cur_planes in tqdm(frame_pairs, total=len(x)):
+                times, _ = measure(
+                    lambda associator: associator.associate(method),
+                    10,
+                    setup=partial(__get_fresh_associator, prev_planes, cur_planes),
+                )
+                results.append(mean(times) / 1e9)
+            total_results[
+                f"{type(method).__name__}_v{voxel_size}_u{sample_rate}"
+            ] = results
+            plt.plot(
+                x,
+                results,
+                label=f"{type(method).__name__}_v{voxel_size}_u{sample_rate}",
+            )
 
     plt.xlabel("Position number")
     plt.title("Plane association performance")
@@ -123,6 +446,59 @@ def performance_test(methods: List[Tuple[AssocMethod, float, int]], loader: Load
         dump_res_to_csv(file, x, total_results)
 
 
+def __get_fresh_associator(prev_planes: PlaneSet, cur_planes: PlaneSet) -> Associator:
+    # Each timed run builds point labels and sketches of planes again,
+    # as association of newly loaded frames does
+    return Associator(cur_planes.without_derived(), prev_planes.without_derived())
+
+
+def __iter_loaded_pairs(
+    loader: Loader, frames: range, executor: Optional[Executor], batch_size: int
+) -> Iterator[Tuple[PlaneSet, PlaneSet]]:
+    # Pairs are yielded only after the whole batch is loaded,
+    # so nothing is running in background while they are processed
+    if executor is None:
+        yield from loader.iter_frame_pairs(frames.step, prefetch=0)
+        return
+    load_pairs = partial(__load_pairs, loader.voxel_size, loader.sample_rate)
+    for batch in split_range(frames, batch_size):
+        for pairs in list(executor.map(load_pairs, split_range(batch, 1))):
+            yield from pairs
+
+
+def __load_pairs(
+    voxel_size: float, sample_rate: int, frames: range
+) -> List[Tuple[PlaneSet, PlaneSet]]:
+    __worker_loader.set_down_sample_params(voxel_size, sample_rate)
+    return list(
+        __worker_loader.iter_frame_pairs(
+            frames.step, prefetch=0, start=frames.start, stop=frames.stop
+        )
+    )
+
+
+def create_worker_pool(loader: Loader, workers: int):
+    """
+    Creates pool of processes with own copy of the loader,
+    for single worker nothing is created and the context is None
+    """
+    if workers == 1:
+        return nullcontext()
+    return ProcessPoolExecutor(workers, initializer=__init_worker, initargs=(loader,))
+
+
+def __init_worker(loader: Loader):
+    global __worker_loader
+    __worker_loader = loader
+
+
+def split_range(frames: range, chunk_size: int) -> List[range]:
+    return [
+        frames[start : start + chunk_size]
+        for start in range(0, len(frames), chunk_size)
+    ]
+
+
 def dump_res_to_csv(file, x, data_dict: dict):
     header = list(data_dict.keys())
     writer = csv.writer(file, delimiter=",", quotechar="|")
@@ -1,20 +1,30 @@
 import argparse
 import configparser
+from typing import Optional
+
+import numpy as np
 import open3d as o3d
 import experiments
 from association.assoc_methods.jaccard_thresholded import JaccardThresholded
 from association.assoc_methods.jaccard_weighed import JaccardWeighed
 from cloud_processing.loader import Loader
+from cloud_processing.packed_loader import PackedLoader
+from tracing import TRACER
+
+
+def create_loader(
+    path_to_depth: str,
+    path_to_labeled_images: str,
+    config_path: str,
+    depth_format: str,
+    dtype: type = np.float64,
+    cache_dir: Optional[str] = None,
+) -> Loader:
+    if depth_format == "packed":
+        return PackedLoader(path_to_depth, cache_dir=cache_dir, dtype=dtype)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("path_to_depth")
-    parser.add_argument("path_to_labeled_images")
-    parser.add_argument("config_path")
-    parser.add_argument("depth_format")
-    args = parser.parse_args()
     config = configparser.ConfigParser()
-    config.read(args.config_path)
+    config.read(config_path)
 
     intrinsics_config = config["INTRINSICS"]
     intrinsics = o3d.camera.PinholeCameraIntrinsic(
@@ -27,17 +37,75 @@ if __name__ == "__main__":
     )
 
     scale = int(intrinsics_config["scale"])
-    loader = Loader(
-        args.path_to_depth,
-        args.depth_format,
-        args.path_to_labeled_images,
+    return Loader(
+        path_to_depth,
+        depth_format,
+        path_to_labeled_images,
         intrinsics,
         scale,
+        cache_dir=cache_dir,
+        dtype=dtype,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path_to_depth")
+    parser.add_argument("path_to_labeled_images")
+    parser.add_argument("config_path")
+    parser.add_argument("depth_format")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--minhash",
+        action="store_true",
+        help="Compare quality with approximate MinHash Jaccard indices",
+    )
+    parser.add_argument(
+        "--precision",
+        action="store_true",
+        help="Compare quality with float32 points and plane geometry",
+    )
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="Keep points and plane geometry in float32",
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        help="Write spans of stages to Chrome trace JSON and print their summary, "
+        "spans of worker processes aren't recorded",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Store extracted planes in the directory, so reruns skip preprocessing",
+    )
+    args = parser.parse_args()
+    if args.trace is not None:
+        TRACER.enable()
+    loader = create_loader(
+        args.path_to_depth,
+        args.path_to_labeled_images,
+        args.config_path,
+        args.depth_format,
+        np.float32 if args.float32 else np.float64,
+        args.cache_dir,
     )
 
     jaccard_thresholded = JaccardThresholded()
     jaccard_weighed = JaccardWeighed()
     methods = [(jaccard_weighed, 0, 1), (jaccard_thresholded, 0, 1)]
 
-    experiments.performance_test(methods, loader)
-    experiments.quality_test(methods, loader)
+    experiments.sweep_test(methods, loader, args.workers)
+    print(
+        "Pairs pruned by JaccardThresholded: "
+        f"{jaccard_thresholded.get_prune_report()}"
+    )
+    if args.minhash:
+        experiments.approximation_test(methods, loader, args.workers)
+    if args.precision:
+        experiments.precision_test(methods, loader, args.workers)
+    if args.trace is not None:
+        TRACER.export_chrome_trace(args.trace)
+        print(TRACER.format_summary())
@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from association.assoc_methods.assoc_method import AssocMethod
+from association.assoc_methods.jaccard_weighed import JaccardWeighed
+from association.sequence_associator import SequenceAssociator
+from benchmark import get_statistics
+from cloud_processing.annotator import get_planes_labeled
+from cloud_processing.down_sample import down_sample
+from cloud_processing.loader import Loader
+from dto.plane_set import PlaneSet
+
+STAGES = ["ingest", "project", "annotate", "downsample", "extract", "associate"]
+
+
+class ReplaySource:
+    def __init__(
+        self,
+        loader: Loader,
+        frame_rate: float = 30,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ):
+        """
+        Stand-in for a live sensor that emits frames of a recorded sequence
+        at a fixed rate. Frames are emitted on schedule whether they are
+        taken or not, so a slow consumer makes them drop as with a real sensor
+        :param loader: Loader of the sequence
+        :param frame_rate: Frames per second
+        :param start: First emitted frame
+        :param stop: Bound of emitted frames, the whole sequence by default
+        """
+        self.loader = loader
+        self.frame_rate = frame_rate
+        self.start = start
+        self.stop = loader.get_frames_count() if stop is None else stop
+
+    async def frames(self) -> AsyncIterator[Tuple[int, int]]:
+        """
+        :return: Iterator over frame index and its capture time by perf_counter_ns
+        """
+        start_ns = time.perf_counter_ns()
+        for position, frame_num in enumerate(range(self.start, self.stop)):
+            capture_ns = start_ns + int(position * 1e9 / self.frame_rate)
+            delay = (capture_ns - time.perf_counter_ns()) / 1e9
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield frame_num, capture_ns
+
+
+class FrameTask:
+    def __init__(self, frame_num: int, capture_ns: int):
+        """
+        Frame passing through the stages with data of the last finished stage
+        """
+        self.frame_num = frame_num
+        self.capture_ns = capture_ns
+        self.data = None
+
+
+class OnlinePipeline:
+    def __init__(
+        self,
+        loader: Loader,
+        method: AssocMethod,
+        queue_size: int = 2,
+        executor: Optional[ThreadPoolExecutor] = None,
+        drop_frames: bool = True,
+        optimal: bool = False,
+        on_result: Optional[Callable[[int, PlaneSet, np.ndarray], None]] = None,
+    ):
+        """
+        Associates planes of a frame stream online. Every stage runs in its own
+        coroutine that takes frames in order from a bounded queue and computes
+        them in the executor, so stages of consecutive frames overlap.
+        Association updates the map of planes, so it always runs on its own
+        thread, other stages are stateless and share the executor.
+        A full queue blocks the previous stage, so at most
+        (queue_size + 1) frames are held by each stage and backpressure
+        reaches the source, which drops frames that can't be taken
+        :param loader: Loader that reads frames and keeps down sample parameters
+        :param method: Method for calculating metric between planes
+        :param queue_size: Capacity of the queue before each stage
+        :param executor: Thread pool for stages except association, stages update
+            frames in place, so processes aren't supported.
+            Pool with a thread per stage by default
+        :param drop_frames: Drop frames when the first queue is full,
+            otherwise the source waits and frames are delayed
+        :param optimal: Use globally optimal assignment instead of greedy matching
+        :param on_result: Callback with frame index, its planes and their global IDs
+        """
+        if executor is not None and not isinstance(executor, ThreadPoolExecutor):
+            raise ValueError("Executor of stages must be a thread pool")
+        self.loader = loader
+        self.queue_size = queue_size
+        self.executor = executor
+        self.drop_frames = drop_frames
+        self.on_result = on_result
+        self.associator = SequenceAssociator(method, optimal)
+        self.__stage_functions: Dict[str, Callable] = {
+            "ingest": self.__ingest,
+            "project": self.__project,
+            "annotate": self.__annotate,
+            "downsample": self.__down_sample,
+            "extract": self.__extract,
+            "associate": self.__associate,
+        }
+
+    async def run(self, source: ReplaySource) -> dict:
+        """
+        Processes all frames of the source
+        :param source: Source of frames
+        :return: Report with processed and dropped frames counts and statistics
+            of end-to-end latency and of each stage in milliseconds
+        """
+        own_executor = self.executor is None
+        executor = (
+            ThreadPoolExecutor(max_workers=len(STAGES) - 1)
+            if own_executor
+            else self.executor
+        )
+        associate_executor = ThreadPoolExecutor(max_workers=1)
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in STAGES]
+        stage_times = {stage: [] for stage in STAGES}
+        latencies = []
+        max_depths = [0] * len(STAGES)
+        dropped = []
+
+        async def run_stage(index: int):
+            stage = STAGES[index]
+            function = self.__stage_functions[stage]
+            stage_executor = associate_executor if stage == "associate" else executor
+            loop = asyncio.get_running_loop()
+            while True:
+                task = await queues[index].get()
+                if task is None:
+                    if index + 1 < len(STAGES):
+                        await queues[index + 1].put(None)
+                    return
+                start = time.perf_counter_ns()
+                await loop.run_in_executor(stage_executor, function, task)
+                stage_times[stage].append(time.perf_counter_ns() - start)
+                if index + 1 < len(STAGES):
+                    await queues[index + 1].put(task)
+                    max_depths[index + 1] = max(
+                        max_depths[index + 1], queues[index + 1].qsize()
+                    )
+                else:
+                    latencies.append(time.perf_counter_ns() - task.capture_ns)
+
+        async def feed():
+            async for frame_num, capture_ns in source.frames():
+                task = FrameTask(frame_num, capture_ns)
+                if self.drop_frames:
+                    try:
+                        queues[0].put_nowait(task)
+                    except asyncio.QueueFull:
+                        dropped.append(frame_num)
+                        continue
+                else:
+                    await queues[0].put(task)
+                max_depths[0] = max(max_depths[0], queues[0].qsize())
+            await queues[0].put(None)
+
+        # Failure of any stage stops the others instead of blocking on full queues
+        tasks = [asyncio.create_task(feed())]
+        tasks += [asyncio.create_task(run_stage(index)) for index in range(len(STAGES))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if own_executor:
+                executor.shutdown()
+            associate_executor.shutdown()
+
+        return {
+            "processed": len(latencies),
+            "dropped": len(dropped),
+            "dropped_frames": dropped,
+            "frame_rate": source.frame_rate,
+            "latency": get_statistics(latencies) if len(latencies) != 0 else None,
+            "stages": {
+                stage: get_statistics(times)
+                for stage, times in stage_times.items()
+                if len(times) != 0
+            },
+            "max_queue_depths": dict(zip(STAGES, max_depths)),
+        }
+
+    def __ingest(self, task: FrameTask):
+        if self.loader.has_depth:
+            task.data = self.loader.read_depth(task.frame_num)
+        else:
+            # Stored points are already projected, so the project stage passes them
+            task.data = self.loader.load_points(task.frame_num)
+
+    def __project(self, task: FrameTask):
+        if not self.loader.has_depth:
+            return
+        depth, projector = task.data
+        points, pixel_indices = projector.project(depth, self.loader.drop_invalid)
+        # Projection buffer of the thread is reused by its next frame
+        task.data = points.copy(), pixel_indices
+
+    def __annotate(self, task: FrameTask):
+        points, pixel_indices = task.data
+        labels = self.loader.load_frame_labels(task.frame_num, pixel_indices)
+        task.data = points, labels, pixel_indices
+
+    def __down_sample(self, task: FrameTask):
+        points, labels, pixel_indices = task.data
+        task.data = down_sample(
+            points,
+            labels,
+            self.loader.voxel_size,
+            self.loader.sample_rate,
+            pixel_indices,
+        )
+
+    def __extract(self, task: FrameTask):
+        points, labels, pixel_indices, pixel_offsets = task.data
+        task.data = get_planes_labeled(
+            points, labels, self.loader.with_bitmask, pixel_indices, pixel_offsets
+        )
+
+    def __associate(self, task: FrameTask):
+        planes = task.data
+        ids = self.associator.push(planes)
+        if self.on_result is not None:
+            self.on_result(task.frame_num, planes, ids)
+        task.data = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Associates planes of a replayed sequence online"
+    )
+    parser.add_argument("path_to_depth")
+    parser.add_argument("path_to_labeled_images")
+    parser.add_argument("config_path")
+    parser.add_argument("depth_format")
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument(
+        "--no-drop",
+        action="store_true",
+        help="Delay frames instead of dropping them when the pipeline is full",
+    )
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    from main import create_loader
+
+    replay_loader = create_loader(
+        args.path_to_depth,
+        args.path_to_labeled_images,
+        args.config_path,
+        args.depth_format,
+    )
+    pipeline = OnlinePipeline(
+        replay_loader,
+        JaccardWeighed(),
+        queue_size=args.queue_size,
+        drop_frames=not args.no_drop,
+    )
+    report = asyncio.run(pipeline.run(ReplaySource(replay_loader, args.fps)))
+    print(
+        f"Processed {report['processed']} frames, dropped {report['dropped']}, "
+        f"latency p50 {report['latency']['p50_ms']:.1f} ms, "
+        f"p99 {report['latency']['p99_ms']:.1f} ms"
+    )
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
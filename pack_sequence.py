@@ -0,0 +1,30 @@
+import argparse
+import configparser
+
+from cloud_processing.packed_loader import pack_sequence
+from main import create_loader
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Packs points and labels of a sequence into a single file "
+        "that is memory-mapped by Loader with 'packed' depth format"
+    )
+    parser.add_argument("path_to_depth")
+    parser.add_argument("path_to_labeled_images")
+    parser.add_argument("config_path")
+    parser.add_argument("depth_format")
+    parser.add_argument("output_path")
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read(args.config_path)
+
+    loader = create_loader(
+        args.path_to_depth,
+        args.path_to_labeled_images,
+        args.config_path,
+        args.depth_format,
+    )
+    metadata = {section: dict(config[section]) for section in config.sections()}
+    metadata["depth_format"] = args.depth_format
+    frames_count = pack_sequence(loader, args.output_path, metadata)
+    print(f"Packed {frames_count} frames")
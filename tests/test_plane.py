@@ -0,0 +1,87 @@
+import unittest
+
+import numpy as np
+
+from dto.plane import Plane
+
+
+def get_normal_eig(points):
+    """
+    Fitting of a single plane before batched get_normals, kept as the reference
+    """
+    c = np.mean(points, axis=0)
+    A = np.array(points) - c
+    eigvals, eigvects = np.linalg.eig(A.T @ A)
+    min_index = np.argmin(eigvals)
+    n = eigvects[:, min_index]
+
+    d = -np.dot(n, c)
+    normal = int(np.sign(d)) * n
+    d *= np.sign(d)
+    return np.asarray([normal[0], normal[1], normal[2], d])
+
+
+def get_noisy_planes(planes_count, seed=0):
+    """
+    :return: Points of planes grouped by plane and offsets of planes
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(3, 2000, planes_count)
+    points = []
+    for size in sizes:
+        normal = rng.normal(size=3)
+        normal /= np.linalg.norm(normal)
+        basis = np.linalg.svd(normal[np.newaxis])[2][1:]
+        centroid = normal * rng.uniform(0.5, 5)
+        coordinates = rng.uniform(-2, 2, (size, 2))
+        noise = rng.normal(scale=0.01, size=(size, 1))
+        points.append(centroid + coordinates @ basis + noise * normal)
+    return np.concatenate(points), np.concatenate([[0], np.cumsum(sizes)])
+
+
+class TestGetNormals(unittest.TestCase):
+    def setUp(self):
+        self.points, self.offsets = get_noisy_planes(50)
+        self.expected = np.asarray(
+            [
+                get_normal_eig(self.points[start:end])
+                for start, end in zip(self.offsets[:-1], self.offsets[1:])
+            ]
+        )
+
+    def test_float64_matches_eig(self):
+        equations = Plane.get_normals(self.points, self.offsets)
+        self.assertEqual(equations.dtype, np.float64)
+        np.testing.assert_allclose(equations, self.expected, atol=1e-8)
+
+    def test_float32_matches_eig(self):
+        equations = Plane.get_normals(
+            self.points.astype(np.float32), self.offsets, np.float32
+        )
+        self.assertEqual(equations.dtype, np.float32)
+        np.testing.assert_allclose(equations, self.expected, atol=2e-3)
+
+    def test_sign_convention(self):
+        for dtype in [np.float64, np.float32]:
+            equations = Plane.get_normals(self.points, self.offsets, dtype)
+            self.assertTrue((equations[:, 3] >= 0).all())
+            np.testing.assert_array_equal(
+                np.sign(equations[:, :3]), np.sign(self.expected[:, :3])
+            )
+
+    def test_single_plane(self):
+        start, end = self.offsets[:2]
+        np.testing.assert_allclose(
+            Plane.get_normal(self.points[start:end]), self.expected[0], atol=1e-8
+        )
+
+    def test_empty_plane_keeps_others(self):
+        offsets = np.insert(self.offsets, 1, 0)
+        equations = Plane.get_normals(self.points, offsets)
+        np.testing.assert_allclose(
+            np.delete(equations, 0, axis=0), self.expected, atol=1e-8
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
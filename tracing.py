@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import List, Optional
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, args: dict):
+        """
+        Timed stage, nested spans of the same thread are its children
+        :param tracer: Tracer that records the span
+        :param name: Name of the stage
+        :param args: Frame index, points and planes counts or other values of the stage
+        """
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+        self.children_ns = 0
+
+    def set(self, **args):
+        """
+        Adds values that are known only inside the stage
+        """
+        self.args.update(args)
+
+    def __enter__(self) -> "Span":
+        self.tracer.get_stack().append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter_ns() - self.start
+        stack = self.tracer.get_stack()
+        stack.pop()
+        if len(stack) != 0:
+            stack[-1].children_ns += duration
+        self.tracer.record(
+            {
+                "name": self.name,
+                "ph": "X",
+                "ts": self.start / 1e3,
+                "dur": duration / 1e3,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {**self.args, "self_us": (duration - self.children_ns) / 1e3},
+            }
+        )
+
+
+class DisabledSpan:
+    def set(self, **args):
+        pass
+
+    def __enter__(self) -> "DisabledSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class Tracer:
+    __DISABLED_SPAN = DisabledSpan()
+
+    def __init__(self):
+        """
+        Records nested spans of stages from all threads.
+        Tracing is disabled by default, then span costs one check
+        and returns a shared no-op span
+        """
+        self.enabled = False
+        self.__events: List[dict] = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def span(self, name: str, **args):
+        """
+        Context manager that records the stage if tracing is enabled
+        :param name: Name of the stage
+        :param args: Frame index, points and planes counts or other values of the stage
+        """
+        if not self.enabled:
+            return self.__DISABLED_SPAN
+        return Span(self, name, args)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.__lock:
+            self.__events.clear()
+
+    def get_stack(self) -> List[Span]:
+        """
+        :return: Open spans of the calling thread
+        """
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = []
+            self.__local.stack = stack
+        return stack
+
+    def record(self, event: dict):
+        with self.__lock:
+            self.__events.append(event)
+
+    def get_events(self) -> List[dict]:
+        """
+        :return: Recorded spans as complete events of Chrome trace format,
+            times are in microseconds
+        """
+        with self.__lock:
+            return list(self.__events)
+
+    def export_chrome_trace(self, path: str):
+        """
+        Writes recorded spans to JSON that can be opened in chrome://tracing or Perfetto
+        """
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.get_events(), "displayTimeUnit": "ms"}, file)
+
+    def get_summary(self) -> dict:
+        """
+        Aggregates spans by name. Self time excludes nested spans,
+        so self times of all stages sum up to the traced time
+        :return: Count, total, self, mean and max times in milliseconds of each stage
+        """
+        durations = defaultdict(list)
+        self_durations = defaultdict(float)
+        for event in self.get_events():
+            durations[event["name"]].append(event["dur"] / 1e3)
+            self_durations[event["name"]] += event["args"]["self_us"] / 1e3
+        return {
+            name: {
+                "count": len(name_durations),
+                "total_ms": sum(name_durations),
+                "self_ms": self_durations[name],
+                "mean_ms": sum(name_durations) / len(name_durations),
+                "max_ms": max(name_durations),
+            }
+            for name, name_durations in durations.items()
+        }
+
+    def format_summary(self, summary: Optional[dict] = None) -> str:
+        """
+        :param summary: Summary to format, summary of recorded spans by default
+        :return: Table of stages sorted by self time with share of all self time
+        """
+        if summary is None:
+            summary = self.get_summary()
+        traced_ms = sum(statistics["self_ms"] for statistics in summary.values())
+        lines = [
+            f"{'stage':<24}{'count':>8}{'total ms':>12}{'self ms':>12}"
+            f"{'mean ms':>10}{'max ms':>10}{'self %':>8}"
+        ]
+        for name, statistics in sorted(
+            summary.items(), key=lambda item: item[1]["self_ms"], reverse=True
+        ):
+            share = statistics["self_ms"] / traced_ms if traced_ms > 0 else 0
+            lines.append(
+                f"{name:<24}{statistics['count']:>8}{statistics['total_ms']:>12.2f}"
+                f"{statistics['self_ms']:>12.2f}{statistics['mean_ms']:>10.3f}"
+                f"{statistics['max_ms']:>10.3f}{share:>8.1%}"
+            )
+        return "\n".join(lines)
+
+
+# Tracer of the process, stages of loader and associator are recorded with it
+TRACER = Tracer()